@@ -0,0 +1,309 @@
+import asyncio
+import email
+import logging
+import re
+import ssl
+
+from email_client import FetchCursor, compress_uid_set, parse_fetch_response
+
+_LITERAL_SUFFIX = re.compile(rb'\{(\d+)\}$')
+_TAGGED = re.compile(rb'^(?P<tag>[A-Z]\d+) (?P<status>[A-Z]+) ?(?P<text>.*)$')
+_UNTAGGED_FETCH = re.compile(rb'^(\d+) FETCH ')
+_UIDVALIDITY = re.compile(rb'\[UIDVALIDITY (\d+)\]')
+# Literals are read in pieces, so the timeout bounds each piece, not the whole message
+LITERAL_READ_BYTES = 64 * 1024
+
+
+def _quote(value):
+    return '"' + str(value).replace('\\', '\\\\').replace('"', '\\"') + '"'
+
+
+class IMAPCommandError(Exception):
+    pass
+
+
+class AsyncIMAPConnection:
+    """
+    Minimal asyncio IMAP4rev1 connection that allows several tagged commands
+    to be in flight at once. A single reader task consumes the stream and
+    completes the matching command when its tagged response arrives.
+    Untagged responses are handed to every command pending at that time;
+    UID FETCH callers pick out their own UIDs.
+
+    `timeout` bounds each read rather than each command: while a command
+    is pending, the server going silent for that long fails it, but a large
+    FETCH that keeps streaming never times out however long it takes.
+    """
+
+    def __init__(self, host, port, use_ssl=True, timeout=None):
+        self.host = host
+        self.port = port
+        self.use_ssl = use_ssl
+        self.timeout = timeout
+        self.reader = None
+        self.writer = None
+        self._tag_counter = 0
+        self._pending = {}
+        self._reader_task = None
+        # Set when the read loop stops; later commands fail with it instead of waiting forever
+        self._read_error = None
+        self.logger = logging.getLogger(__name__)
+
+    async def open(self):
+        ssl_context = ssl.create_default_context() if self.use_ssl else None
+        self.reader, self.writer = await asyncio.wait_for(
+            asyncio.open_connection(self.host, self.port, ssl=ssl_context),
+            self.timeout
+        )
+        greeting = await asyncio.wait_for(self.reader.readline(), self.timeout)
+        if not greeting.startswith(b'* OK') and not greeting.startswith(b'* PREAUTH'):
+            raise IMAPCommandError(f"Unexpected greeting: {greeting!r}")
+        self._reader_task = asyncio.create_task(self._read_loop())
+
+    async def close(self):
+        try:
+            if self.writer and not self.writer.is_closing():
+                await self.command('LOGOUT')
+        except Exception:
+            pass
+        if self._reader_task:
+            self._reader_task.cancel()
+        if self.writer:
+            self.writer.close()
+
+    async def command(self, *args):
+        """Send one tagged command and wait for its completion.
+        Returns (status, untagged_responses) where each untagged response is
+        a list in imaplib's format: bytes lines and (head, literal) tuples."""
+        if self._read_error is not None:
+            raise self._read_error
+        self._tag_counter += 1
+        tag = f"A{self._tag_counter:04d}"
+        future = asyncio.get_running_loop().create_future()
+        self._pending[tag] = (future, [])
+        self.writer.write(f"{tag} {' '.join(args)}\r\n".encode())
+        await self.writer.drain()
+        status, text, untagged = await future
+        if status != 'OK':
+            raise IMAPCommandError(f"{args[0]} failed: {status} {text.decode(errors='replace')}")
+        return status, untagged
+
+    async def _timed_read(self, read):
+        """Await read(); `timeout` seconds without data fail it only while a command is pending."""
+        if not self.timeout:
+            return await read()
+        while True:
+            try:
+                # A cancelled StreamReader read leaves its data in the buffer
+                return await asyncio.wait_for(read(), self.timeout)
+            except asyncio.TimeoutError:
+                if self._pending:
+                    raise
+
+    async def _read_line(self):
+        line = await self._timed_read(self.reader.readline)
+        if not line:
+            raise ConnectionError("IMAP connection closed by server")
+        return line.rstrip(b'\r\n')
+
+    async def _read_literal(self, size):
+        chunks = []
+        while size:
+            data = await self._timed_read(lambda: self.reader.read(min(size, LITERAL_READ_BYTES)))
+            if not data:
+                raise ConnectionError("IMAP connection closed by server")
+            chunks.append(data)
+            size -= len(data)
+        return b''.join(chunks)
+
+    async def _read_loop(self):
+        try:
+            while True:
+                line = await self._read_line()
+                if line.startswith(b'* '):
+                    data = line[2:]
+                    items = []
+                    match = _LITERAL_SUFFIX.search(data)
+                    while match:
+                        literal = await self._read_literal(int(match.group(1)))
+                        items.append((data, literal))
+                        data = await self._read_line()
+                        match = _LITERAL_SUFFIX.search(data)
+                    items.append(data)
+                    for _, untagged in self._pending.values():
+                        untagged.append(items)
+                elif line.startswith(b'+'):
+                    continue
+                else:
+                    match = _TAGGED.match(line)
+                    if not match:
+                        self.logger.warning(f"Unexpected IMAP line: {line[:80]!r}")
+                        continue
+                    tag = match.group('tag').decode()
+                    future, untagged = self._pending.pop(tag, (None, None))
+                    if future and not future.done():
+                        future.set_result((match.group('status').decode(), match.group('text'), untagged))
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self._read_error = e
+            for future, _ in self._pending.values():
+                if not future.done():
+                    future.set_exception(e)
+            self._pending.clear()
+
+    async def login(self, user, password):
+        await self.command('LOGIN', _quote(user), _quote(password))
+
+    async def select(self, mailbox='INBOX'):
+        """Returns the mailbox UIDVALIDITY, or None if the server sent none."""
+        _, untagged = await self.command('SELECT', _quote(mailbox))
+        for items in untagged:
+            match = _UIDVALIDITY.search(items[-1]) if isinstance(items[-1], bytes) else None
+            if match:
+                return int(match.group(1))
+        return None
+
+    async def uid_search(self, criteria):
+        _, untagged = await self.command('UID', 'SEARCH', criteria)
+        uids = []
+        for items in untagged:
+            line = items[-1] if isinstance(items[-1], bytes) else b''
+            if line.startswith(b'SEARCH'):
+                uids.extend(int(uid) for uid in line.split()[1:])
+        return uids
+
+    async def uid_fetch(self, uids, items):
+        """Returns {uid: record} for the requested UIDs, see parse_fetch_response."""
+        wanted = {str(uid) for uid in uids}
+        _, untagged = await self.command('UID', 'FETCH', compress_uid_set(uids), items)
+        msg_data = []
+        for response in untagged:
+            first = response[0][0] if isinstance(response[0], tuple) else response[0]
+            if not _UNTAGGED_FETCH.match(first):
+                continue
+            for item in response:
+                if isinstance(item, tuple):
+                    msg_data.append((_UNTAGGED_FETCH.sub(rb'\1 ', item[0], count=1), item[1]))
+                else:
+                    msg_data.append(_UNTAGGED_FETCH.sub(rb'\1 ', item, count=1))
+        return {uid: record for uid, record in parse_fetch_response(msg_data).items() if uid in wanted}
+
+
+class AsyncEmailClient:
+    """
+    asyncio counterpart to EmailClient for large backfills.
+
+    Opens `connections` connections to the same mailbox, splits the UID
+    snapshot into disjoint contiguous ranges, one per connection, and keeps
+    up to `pipeline_depth` UID FETCH commands in flight on each connection.
+    Batches are yielded as they complete, so they can arrive out of UID
+    order; use UIDWatermark to move the checkpoint.
+    """
+
+    def __init__(self, email_account, connections=4, pipeline_depth=4, batch_size=100, timeout=None):
+        self.email = email_account['email']
+        self.password = email_account['password']
+        self.server = email_account['imap_server']
+        self.port = email_account['imap_port']
+        self.use_ssl = email_account.get('imap_ssl', True)
+        self.timeout = timeout or email_account.get('imap_timeout')
+        self.connection_count = max(1, connections)
+        self.pipeline_depth = max(1, pipeline_depth)
+        self.batch_size = batch_size
+        self.connections = []
+        self.uid_validity = None
+        self.logger = logging.getLogger(__name__)
+
+    async def connect(self):
+        try:
+            for _ in range(self.connection_count):
+                conn = AsyncIMAPConnection(self.server, self.port, self.use_ssl, self.timeout)
+                await conn.open()
+                await conn.login(self.email, self.password)
+                self.uid_validity = await conn.select('INBOX')
+                self.connections.append(conn)
+            return True
+        except Exception as e:
+            self.logger.error(f"Async connection failed for {self.email}: {str(e)}")
+            await self.disconnect()
+            return False
+
+    async def disconnect(self):
+        for conn in self.connections:
+            try:
+                await conn.close()
+            except Exception as e:
+                self.logger.error(f"Error disconnecting {self.email}: {str(e)}")
+        self.connections = []
+
+    async def snapshot_uids(self, since_uid=None):
+        next_uid = int(since_uid) + 1 if since_uid else None
+        criteria = f'(UID {next_uid}:*)' if next_uid else 'ALL'
+        uids = await self.connections[0].uid_search(criteria)
+        if next_uid:
+            uids = [uid for uid in uids if uid >= next_uid]
+        return FetchCursor(uids, since_uid=since_uid)
+
+    def _partition(self, uids):
+        """Split ascending UIDs into one contiguous range per connection."""
+        count = len(self.connections)
+        size = -(-len(uids) // count) if uids else 0
+        return [uids[i * size:(i + 1) * size] for i in range(count) if uids[i * size:(i + 1) * size]]
+
+    async def _fetch_range(self, conn, uids, queue):
+        batches = [uids[i:i + self.batch_size] for i in range(0, len(uids), self.batch_size)]
+        in_flight = asyncio.Semaphore(self.pipeline_depth)
+
+        async def fetch_one(batch):
+            # Hold the slot until the batch is on the queue. put() waits while
+            # the bounded queue is full, so each connection has at most
+            # pipeline_depth batches fetched but not yet queued
+            async with in_flight:
+                try:
+                    records = await conn.uid_fetch(batch, '(RFC822)')
+                except Exception as e:
+                    self.logger.error(f"Async fetch failed for {self.email} ({len(batch)} messages): {str(e)}")
+                    return
+                emails = []
+                for uid in batch:
+                    raw_email = records.get(str(uid), {}).get('RFC822')
+                    if isinstance(raw_email, bytes):
+                        emails.append({
+                            'uid': str(uid),
+                            'message': email.message_from_bytes(raw_email),
+                            'raw': raw_email
+                        })
+                await queue.put((emails, batch))
+
+        await asyncio.gather(*(fetch_one(batch) for batch in batches))
+
+    async def iter_batches(self, cursor):
+        """
+        Async generator of (emails, batch_uids). batch_uids lists every UID
+        the batch covered, including ones the server no longer returned;
+        batches whose FETCH failed are not yielded at all.
+        """
+        uids = list(cursor.uids)
+        queue = asyncio.Queue(maxsize=len(self.connections) * self.pipeline_depth)
+        producers = [
+            asyncio.create_task(self._fetch_range(conn, part, queue))
+            for conn, part in zip(self.connections, self._partition(uids))
+        ]
+        done = asyncio.gather(*producers)
+        try:
+            while True:
+                getter = asyncio.ensure_future(queue.get())
+                finished, _ = await asyncio.wait({getter, done}, return_when=asyncio.FIRST_COMPLETED)
+                if getter in finished:
+                    yield getter.result()
+                    continue
+                getter.cancel()
+                while not queue.empty():
+                    yield queue.get_nowait()
+                break
+        finally:
+            if not done.done():
+                done.cancel()
+            elif not done.cancelled() and done.exception():
+                self.logger.error(f"Async fetch aborted for {self.email}: {done.exception()}")
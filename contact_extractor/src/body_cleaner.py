@@ -0,0 +1,105 @@
+import re
+from html import unescape
+from html.parser import HTMLParser
+
+# Bodies are cut to this many characters after cleaning
+MAX_CLEAN_BODY_CHARS = 20000
+
+# Markup that means a text/plain part is really HTML; a bare "<name@host>" is not
+_MARKUP = re.compile(
+    r"<\s*/?\s*(?:html|head|body|div|p|br|span|table|tr|td|a|b|i|u|font|strong|em|ul|ol|li|img|style|meta|h[1-6])\b",
+    re.IGNORECASE
+)
+
+# Elements that end a line of text
+_BLOCK_TAGS = frozenset({
+    "address", "article", "blockquote", "br", "div", "dl", "dt", "dd", "footer", "form",
+    "h1", "h2", "h3", "h4", "h5", "h6", "header", "hr", "li", "ol", "p", "pre", "section",
+    "table", "td", "th", "tr", "ul"
+})
+# Elements whose content is never text
+_SKIPPED_TAGS = frozenset({"head", "script", "style", "title", "template"})
+
+_ORIGINAL_MESSAGE = "-----Original Message-----"
+
+
+class _TextExtractor(HTMLParser):
+    """Collects the text of an HTML document in one streaming pass."""
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.parts = []
+        self._skip_depth = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in _SKIPPED_TAGS:
+            self._skip_depth += 1
+        elif tag in _BLOCK_TAGS:
+            self.parts.append("\n")
+
+    def handle_startendtag(self, tag, attrs):
+        if tag in _BLOCK_TAGS:
+            self.parts.append("\n")
+
+    def handle_endtag(self, tag):
+        if tag in _SKIPPED_TAGS:
+            self._skip_depth = max(0, self._skip_depth - 1)
+        elif tag in _BLOCK_TAGS:
+            self.parts.append("\n")
+
+    def handle_data(self, data):
+        if not self._skip_depth:
+            self.parts.append(data)
+
+
+def html_to_text(html):
+    """Text of an HTML body, with block elements on their own lines."""
+    parser = _TextExtractor()
+    parser.feed(html)
+    parser.close()
+    return "".join(parser.parts)
+
+
+def trim_quoted_reply(text):
+    """
+    Cut the text at the start of a quoted reply: the first "On ... wrote:"
+    within a line, or an "-----Original Message-----" line. One forward
+    pass of plain string searches, with no backtracking on long lines.
+    Signatures above the quote are kept since they carry contact details.
+    """
+    start = 0
+    while start < len(text):
+        # Lines end at "\n" only, like "." in the regex below
+        end = text.find("\n", start)
+        end = len(text) if end == -1 else end + 1
+        line = text[start:end]
+        wrote = line.rfind(" wrote:")
+        if wrote != -1:
+            on = line.find("On ", 0, wrote)
+            # Same cut as re.split(r"On .+ wrote:", text)[0]: at least one character in between
+            if on != -1 and on + 3 < wrote:
+                return text[:start + on]
+        if line.strip() == _ORIGINAL_MESSAGE:
+            return text[:start]
+        start = end
+    return text
+
+
+def clean_body(text, is_html=False, max_chars=MAX_CLEAN_BODY_CHARS):
+    """
+    Plain text for classification and extraction, in three tiers:
+    text without markup is only unescaped and trimmed, HTML (a text/html
+    part, or text/plain containing tags) goes through the streaming
+    converter, and every body has its quoted reply cut and is capped at
+    max_chars.
+    """
+    if not text:
+        return ""
+    if is_html or _MARKUP.search(text):
+        text = html_to_text(text)
+    elif "&" in text:
+        text = unescape(text)
+    text = trim_quoted_reply(text)
+    if max_chars and len(text) > max_chars:
+        text = text[:max_chars]
+    return text.strip()
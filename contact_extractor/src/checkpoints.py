@@ -0,0 +1,128 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+from datetime import datetime
+
+
+class CheckpointStore:
+    """
+    Per-account sync checkpoints in an embedded SQLite database (WAL mode).
+
+    Each account is one row holding last_uid, the mailbox UIDVALIDITY the
+    UID belongs to, and timestamps, so saving a checkpoint is a single-row
+    upsert instead of rewriting a JSON file. SQLite's locking makes writes
+    safe across threads and processes, and a save never moves an account's
+    last_uid backwards within the same UIDVALIDITY.
+
+    An existing last_run.json is imported the first time the store is created.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS checkpoints (
+            account TEXT PRIMARY KEY,
+            last_uid INTEGER,
+            uid_validity INTEGER,
+            last_run TEXT,
+            created_at TEXT DEFAULT CURRENT_TIMESTAMP
+        )
+    """
+
+    def __init__(self, path, legacy_json_path=None):
+        self.logger = logging.getLogger(__name__)
+        self.path = path
+        self._local = threading.local()
+        conn = self._connection()
+        conn.execute(self.SCHEMA)
+        if legacy_json_path:
+            self._import_json(legacy_json_path)
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def _import_json(self, json_path):
+        if not os.path.exists(json_path):
+            return
+        conn = self._connection()
+        if conn.execute("SELECT 1 FROM checkpoints LIMIT 1").fetchone():
+            return
+        try:
+            with open(json_path, 'r') as f:
+                data = json.load(f)
+            conn.executemany(
+                "INSERT OR IGNORE INTO checkpoints (account, last_uid, last_run) VALUES (?, ?, ?)",
+                [
+                    (account, int(entry['last_uid']) if entry.get('last_uid') else None, entry.get('last_run'))
+                    for account, entry in data.items()
+                ]
+            )
+            self.logger.info(f"Imported {len(data)} checkpoints from {json_path}")
+        except Exception as e:
+            self.logger.error(f"Error importing checkpoints from {json_path}: {str(e)}")
+
+    def get(self, account):
+        """{'last_uid', 'uid_validity', 'last_run'} for the account, or None."""
+        row = self._connection().execute(
+            "SELECT last_uid, uid_validity, last_run FROM checkpoints WHERE account=?", (account,)
+        ).fetchone()
+        if row is None:
+            return None
+        return {'last_uid': row[0], 'uid_validity': row[1], 'last_run': row[2]}
+
+    def load_all(self):
+        """Every checkpoint in the last_run.json layout: {account: {'last_uid': str, 'last_run': iso}}."""
+        rows = self._connection().execute("SELECT account, last_uid, last_run FROM checkpoints")
+        return {
+            account: {'last_uid': str(last_uid) if last_uid is not None else None, 'last_run': last_run}
+            for account, last_uid, last_run in rows
+        }
+
+    def resolve(self, account, uid_validity=None):
+        """
+        Checkpoint UID to resume from for a mailbox opened with the given
+        UIDVALIDITY. When it differs from the stored one the old UIDs are
+        meaningless, so the checkpoint is reset and None is returned.
+        """
+        checkpoint = self.get(account)
+        if checkpoint is None:
+            return None
+        stored = checkpoint['uid_validity']
+        if uid_validity is not None and stored is not None and int(stored) != int(uid_validity):
+            self.logger.warning(
+                f"UIDVALIDITY for {account} changed from {stored} to {uid_validity}; "
+                f"discarding checkpoint at UID {checkpoint['last_uid']} and resyncing"
+            )
+            self.reset(account, uid_validity)
+            return None
+        last_uid = checkpoint['last_uid']
+        return str(last_uid) if last_uid is not None else None
+
+    def save(self, account, last_uid, uid_validity=None):
+        """Record last_uid; ignored if it is behind the stored UID for the same UIDVALIDITY."""
+        self._connection().execute("""
+            INSERT INTO checkpoints (account, last_uid, uid_validity, last_run)
+            VALUES (?, ?, ?, ?)
+            ON CONFLICT (account) DO UPDATE SET
+                last_uid = excluded.last_uid,
+                uid_validity = COALESCE(excluded.uid_validity, checkpoints.uid_validity),
+                last_run = excluded.last_run
+            WHERE checkpoints.last_uid IS NULL
+               OR excluded.last_uid >= checkpoints.last_uid
+               OR (excluded.uid_validity IS NOT NULL AND excluded.uid_validity IS NOT checkpoints.uid_validity)
+        """, (account, int(last_uid), uid_validity, datetime.now().isoformat()))
+
+    def reset(self, account, uid_validity=None):
+        self._connection().execute("""
+            INSERT INTO checkpoints (account, last_uid, uid_validity, last_run)
+            VALUES (?, NULL, ?, ?)
+            ON CONFLICT (account) DO UPDATE SET
+                last_uid = NULL,
+                uid_validity = excluded.uid_validity,
+                last_run = excluded.last_run
+        """, (account, uid_validity, datetime.now().isoformat()))
@@ -0,0 +1,122 @@
+import logging
+import os
+import signal
+import threading
+from email_client import EmailClient
+from extractor import NERContactExtractor
+from filters import MLRecruiterFilter
+from main import (
+    IMAP_TIMEOUT_SECONDS, INITIAL_SYNC_DAYS, NER_BATCH_SIZE, NER_PROCESSES, RECRUITER_THRESHOLD,
+    create_dedup_index, create_storage, drain_account, load_accounts
+)
+
+# Re-issue IDLE before the 30 minute server timeout from RFC 2177
+IDLE_TIMEOUT_SECONDS = float(os.getenv('IDLE_TIMEOUT_SECONDS', 25 * 60))
+POLL_INTERVAL_SECONDS = float(os.getenv('POLL_INTERVAL_SECONDS', 60))
+RECONNECT_MIN_SECONDS = 5
+RECONNECT_MAX_SECONDS = 300
+
+
+class MailboxWatcher(threading.Thread):
+    """
+    Keeps one persistent IMAP connection to an account and pushes new mail
+    through the filter/extract/store pipeline as soon as the server reports
+    it, via IDLE or NOOP polling. Reconnects with exponential backoff,
+    which is only reset once a drain has succeeded, so an account that
+    connects but then fails is retried at growing intervals too.
+    """
+
+    def __init__(self, account, storage, extractor, email_filter, stop_event, batch_size=100, dedup_index=None):
+        super().__init__(name=f"watch-{account['email']}", daemon=True)
+        self.account = account
+        self.storage = storage
+        self.extractor = extractor
+        self.email_filter = email_filter
+        self.stop_event = stop_event
+        self.batch_size = batch_size
+        self.dedup_index = dedup_index
+        self.logger = logging.getLogger(__name__)
+
+    def run(self):
+        backoff = RECONNECT_MIN_SECONDS
+        while not self.stop_event.is_set():
+            email_client = EmailClient(
+                self.account,
+                sender_filter=self.email_filter.is_junk_email,
+                timeout=IMAP_TIMEOUT_SECONDS,
+                server_rules=self.email_filter.sender_rules,
+                initial_sync_days=INITIAL_SYNC_DAYS
+            )
+            if not email_client.connect():
+                self.stop_event.wait(backoff)
+                backoff = min(backoff * 2, RECONNECT_MAX_SECONDS)
+                continue
+
+            try:
+                # Catch up on anything that arrived while disconnected
+                self._drain(email_client)
+                backoff = RECONNECT_MIN_SECONDS
+                mode = "IDLE" if email_client.supports_idle() else "NOOP polling"
+                self.logger.info(f"Watching {self.account['email']} with {mode}")
+                while not self.stop_event.is_set():
+                    if email_client.wait_for_new_mail(
+                        IDLE_TIMEOUT_SECONDS, POLL_INTERVAL_SECONDS, self.stop_event
+                    ):
+                        self._drain(email_client)
+            except Exception as e:
+                self.logger.error(
+                    f"Watcher for {self.account['email']} lost its connection: {e}; retrying in {backoff:.0f}s"
+                )
+                self.stop_event.wait(backoff)
+                backoff = min(backoff * 2, RECONNECT_MAX_SECONDS)
+            finally:
+                email_client.disconnect()
+
+    def _drain(self, email_client):
+        extracted = drain_account(
+            email_client, self.account, self.storage, self.extractor,
+            self.email_filter, batch_size=self.batch_size, dedup_index=self.dedup_index
+        )
+        if extracted:
+            self.logger.info(f"Extracted {extracted} new contacts for {self.account['email']}")
+
+
+def run_daemon(accounts, storage, extractor, email_filter, stop_event=None, dedup_index=None):
+    """Watch every account until SIGINT/SIGTERM or stop_event is set."""
+    stop_event = stop_event or threading.Event()
+    if threading.current_thread() is threading.main_thread():
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            signal.signal(sig, lambda *_: stop_event.set())
+
+    watchers = [
+        MailboxWatcher(account, storage, extractor, email_filter, stop_event, dedup_index=dedup_index)
+        for account in accounts
+    ]
+    for watcher in watchers:
+        watcher.start()
+    logging.info(f"Daemon watching {len(watchers)} accounts")
+
+    stop_event.wait()
+    logging.info("Stopping daemon...")
+    for watcher in watchers:
+        watcher.join(timeout=RECONNECT_MIN_SECONDS)
+
+
+def main():
+    accounts = load_accounts(filter_tags=["job_search"])
+    if not accounts:
+        logging.error("No active accounts found")
+        return
+
+    # Models are loaded once and shared by every watcher thread
+    storage = create_storage()
+    extractor = NERContactExtractor(batch_size=NER_BATCH_SIZE, n_process=NER_PROCESSES)
+    email_filter = MLRecruiterFilter(model_dir="../models", threshold=RECRUITER_THRESHOLD)
+    try:
+        run_daemon(accounts, storage, extractor, email_filter, dedup_index=create_dedup_index())
+    finally:
+        storage.close()
+
+
+if __name__ == "__main__":
+    main()
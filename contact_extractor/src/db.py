@@ -1,20 +1,28 @@
 import os
+import threading
 import mysql.connector
 from dotenv import load_dotenv
+from storage_backends import MySQLBackend
 
 load_dotenv()
 
+_backend = None
+_backend_lock = threading.Lock()
+
 def get_db_connection():
+    """Pooled MySQL connection; close() returns it to the pool."""
+    global _backend
     try:
-        conn = mysql.connector.connect(
-            host=os.getenv("DB_HOST"),
-            user=os.getenv("DB_USER"),
-            password=os.getenv("DB_PASSWORD"),
-            database=os.getenv("DB_NAME"),
-            port=int(os.getenv("DB_PORT", 3306))
-        )
-        return conn
+        with _backend_lock:
+            if _backend is None:
+                _backend = MySQLBackend(db_config={
+                    'host': os.getenv("DB_HOST"),
+                    'user': os.getenv("DB_USER"),
+                    'password': os.getenv("DB_PASSWORD"),
+                    'database': os.getenv("DB_NAME"),
+                    'port': int(os.getenv("DB_PORT", 3306))
+                }, pool_name='contact_extractor_db')
+        return _backend.get_connection()
     except mysql.connector.Error as err:
         print(f" Database connection error: {err}")
         return None
-
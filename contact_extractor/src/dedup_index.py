@@ -0,0 +1,213 @@
+import hashlib
+import json
+import logging
+import re
+import sqlite3
+import threading
+import time
+from email.utils import parseaddr
+from parsed_email import ParsedEmail
+
+# Max keys per IN (...) list when looking entries up
+LOOKUP_CHUNK_SIZE = 500
+# Expired and surplus entries are pruned every this many writes
+PRUNE_EVERY = 1000
+
+_WHITESPACE = re.compile(r"\s+")
+
+
+def message_keys(parsed):
+    """
+    Dedup keys for a ParsedEmail: its Message-ID, and a hash of sender,
+    subject and whitespace-normalised body for copies that were sent as
+    separate messages.
+    """
+    keys = []
+    message_id = (parsed.get('Message-ID') or '').strip().strip('<>').lower()
+    if message_id:
+        keys.append(f"mid:{message_id}")
+    _, sender = parseaddr(parsed.get('From') or '')
+    body = _WHITESPACE.sub(' ', parsed.body).strip().lower()
+    if body:
+        subject = _WHITESPACE.sub(' ', str(parsed.get('Subject') or '')).strip().lower()
+        digest = hashlib.sha1(f"{sender.lower()}\0{subject}\0{body}".encode('utf-8', 'ignore')).hexdigest()
+        keys.append(f"body:{digest}")
+    return keys
+
+
+class DedupIndex:
+    """
+    Persistent index of messages already classified and extracted, shared
+    by every account (and process) through an SQLite file in WAL mode.
+
+    Vendors send the same mail to many candidates; a copy whose Message-ID
+    or sender/subject/body hash is already indexed reuses the stored
+    filter verdict and contact instead of going through the classifier and
+    NER again. Entries expire after ttl_seconds, and the index is trimmed
+    to max_entries by least recent use.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS dedup_index (
+            key TEXT PRIMARY KEY,
+            is_recruiter INTEGER NOT NULL,
+            probability REAL,
+            contact TEXT,
+            created_at REAL NOT NULL,
+            last_seen REAL NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS idx_dedup_last_seen ON dedup_index (last_seen);
+    """
+
+    def __init__(self, path, ttl_seconds=30 * 86400, max_entries=200000):
+        self.logger = logging.getLogger(__name__)
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._writes = 0
+        self.hits = 0
+        self.misses = 0
+        self._connection().executescript(self.SCHEMA)
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def lookup(self, keys):
+        """{key: entry} for the unexpired keys found; entry has is_recruiter, probability, contact."""
+        keys = list(dict.fromkeys(keys))
+        found = {}
+        if not keys:
+            return found
+        conn = self._connection()
+        cutoff = time.time() - self.ttl_seconds
+        for i in range(0, len(keys), LOOKUP_CHUNK_SIZE):
+            chunk = keys[i:i + LOOKUP_CHUNK_SIZE]
+            rows = conn.execute(f"""
+                SELECT key, is_recruiter, probability, contact FROM dedup_index
+                WHERE key IN ({', '.join(['?'] * len(chunk))}) AND created_at >= ?
+            """, chunk + [cutoff])
+            for key, is_recruiter, probability, contact in rows:
+                found[key] = {
+                    'is_recruiter': bool(is_recruiter),
+                    'probability': probability,
+                    'contact': json.loads(contact) if contact else None
+                }
+        if found:
+            now = time.time()
+            conn.executemany("UPDATE dedup_index SET last_seen=? WHERE key=?", [(now, key) for key in found])
+        return found
+
+    def record(self, entries):
+        """Store (keys, is_recruiter, probability, contact) tuples under each of their keys."""
+        now = time.time()
+        rows = [
+            (key, int(bool(is_recruiter)), probability, json.dumps(contact) if contact else None, now, now)
+            for keys, is_recruiter, probability, contact in entries
+            for key in keys
+        ]
+        if not rows:
+            return
+        self._connection().executemany("""
+            INSERT OR REPLACE INTO dedup_index (key, is_recruiter, probability, contact, created_at, last_seen)
+            VALUES (?, ?, ?, ?, ?, ?)
+        """, rows)
+        with self._lock:
+            self._writes += len(rows)
+            prune = self._writes >= PRUNE_EVERY
+            if prune:
+                self._writes = 0
+        if prune:
+            self.prune()
+
+    def prune(self):
+        """Drop expired entries, then the least recently seen ones beyond max_entries."""
+        conn = self._connection()
+        conn.execute("DELETE FROM dedup_index WHERE created_at < ?", (time.time() - self.ttl_seconds,))
+        conn.execute("""
+            DELETE FROM dedup_index WHERE key IN (
+                SELECT key FROM dedup_index ORDER BY last_seen DESC LIMIT -1 OFFSET ?
+            )
+        """, (self.max_entries,))
+
+    def partition(self, emails):
+        """
+        Split a fetched batch into (cached entries, emails still to process).
+        Parses each message once into email_data['parsed'] (which the filter
+        reuses) and keeps its keys on email_data['dedup_keys'] for record_batch.
+        Header-only 'prefiltered' records are passed through untouched.
+        """
+        pending, keyed = [], []
+        for email_data in emails:
+            if email_data.get('prefiltered'):
+                pending.append(email_data)
+                continue
+            try:
+                parsed = email_data.get('parsed') or ParsedEmail(email_data['message'])
+                email_data['parsed'] = parsed
+                email_data['dedup_keys'] = message_keys(parsed)
+                keyed.append(email_data)
+            except Exception as e:
+                self.logger.error(f"Error computing dedup keys: {e}")
+                pending.append(email_data)
+
+        try:
+            found = self.lookup(key for email_data in keyed for key in email_data['dedup_keys'])
+        except Exception as e:
+            self.logger.error(f"Dedup index lookup failed: {e}")
+            found = {}
+
+        cached = []
+        for email_data in keyed:
+            entry = next((found[key] for key in email_data['dedup_keys'] if key in found), None)
+            if entry is None:
+                pending.append(email_data)
+            else:
+                cached.append(entry)
+        with self._lock:
+            self.hits += len(cached)
+            self.misses += len(keyed) - len(cached)
+        return cached, pending
+
+    def record_batch(self, emails, recruiter_emails, contacts):
+        """
+        Index the outcome for processed emails: the verdict for every keyed
+        email, and the contact extracted for the ones kept by the filter.
+        contacts is aligned with recruiter_emails, or None when extraction
+        failed, in which case kept emails are left out so they are retried.
+        """
+        kept = {id(email_data): i for i, email_data in enumerate(recruiter_emails)}
+        entries = []
+        for email_data in emails:
+            keys = email_data.get('dedup_keys')
+            if not keys:
+                continue
+            probability = email_data.get('recruiter_probability')
+            i = kept.get(id(email_data))
+            if i is None:
+                entries.append((keys, False, probability, None))
+            elif contacts is not None:
+                contact = contacts[i]
+                if contact:
+                    contact = {field: value for field, value in contact.items() if field != 'source'}
+                entries.append((keys, True, probability, contact))
+        try:
+            self.record(entries)
+        except Exception as e:
+            self.logger.error(f"Dedup index update failed: {e}")
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+            }
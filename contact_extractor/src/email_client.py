@@ -1,24 +1,437 @@
 import imaplib
 import email
+import re
+import select
+import tempfile
+import threading
+import time
+from datetime import date, timedelta
+from array import array
 from email.header import decode_header
 import logging
+from partial_message import MessagePart, PartialMessage
+
+# Fetch strategies understood by EmailClient.fetch_emails
+FETCH_MODE_SINGLE = 'single'
+FETCH_MODE_BATCH = 'batch'
+FETCH_MODE_HEADERS_FIRST = 'headers_first'
+FETCH_MODE_PARTS = 'parts'
+FETCH_MODE_STREAM = 'stream'
+FETCH_MODES = (FETCH_MODE_SINGLE, FETCH_MODE_BATCH, FETCH_MODE_HEADERS_FIRST, FETCH_MODE_PARTS, FETCH_MODE_STREAM)
+
+# MIME parts read by the extractor; everything else stays on the server in parts mode
+TEXT_PART_TYPES = ('text/plain', 'text/html', 'text/calendar')
+
+# Headers needed by the sender rules in filters.py, fetched in phase one
+HEADER_FIELDS = 'FROM SUBJECT REPLY-TO SENDER MESSAGE-ID CONTENT-TYPE'
+# RFC822.SIZE rides along so phase two can plan its FETCH commands without another round trip
+HEADER_FETCH_ITEMS = f'(UID RFC822.SIZE BODYSTRUCTURE BODY.PEEK[HEADER.FIELDS ({HEADER_FIELDS})])'
+
+# Upper bound on the estimated size of the messages requested by one UID FETCH
+DEFAULT_MAX_FETCH_BYTES = 20 * 1024 * 1024
+# In stream mode, messages above this size are downloaded in chunks to a temp file (0 = never)
+DEFAULT_SPILL_BYTES = 5 * 1024 * 1024
+SPILL_CHUNK_BYTES = 1024 * 1024
+# Keep the UID sequence set well under common server command-line limits
+MAX_UID_SET_LENGTH = 900
+# Same for the NOT FROM criteria of one server-side pre-filter SEARCH
+MAX_SEARCH_CRITERIA_LENGTH = 900
+
+_MONTHS = ('Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec')
+
+_FETCH_START = re.compile(rb'^\d+ \(')
+_LITERAL_SUFFIX = re.compile(rb'\{(\d+)\}$')
+_LITERAL_MARKER = re.compile(r'^\x00(\d+)\x00$')
+_EXISTS_RESPONSE = re.compile(rb'^\* (\d+) EXISTS')
+_EXPUNGE_RESPONSE = re.compile(rb'^\* \d+ EXPUNGE')
+
+
+def compress_uid_set(uids):
+    """
+    Build an IMAP sequence set from UIDs.
+    Example: [101, 105, 110, 111, 112] -> "101,105,110:112"
+    """
+    ordered = sorted({int(uid) for uid in uids})
+    ranges = []
+    for uid in ordered:
+        if ranges and uid == ranges[-1][1] + 1:
+            ranges[-1][1] = uid
+        else:
+            ranges.append([uid, uid])
+    return ",".join(f"{lo}:{hi}" if lo != hi else str(lo) for lo, hi in ranges)
+
+
+def imap_date(value):
+    """Format a date for SEARCH SINCE, independent of the locale: 01-Jan-2026."""
+    return f"{value.day:02d}-{_MONTHS[value.month - 1]}-{value.year}"
+
+
+def _quote_search_string(value):
+    return '"' + str(value).replace('\\', '\\\\').replace('"', '\\"') + '"'
+
+
+# Exclusion criteria per (rule-set version, max length); rules rarely change
+_exclusion_cache = {}
+_exclusion_cache_lock = threading.Lock()
+
+
+def build_exclusion_criteria(server_rules, max_length=MAX_SEARCH_CRITERIA_LENGTH):
+    """
+    Translate a SenderRules' server_search_terms() into chunks of
+    'NOT FROM "<address>"' and 'NOT FROM "@domain>"' keys, each chunk short
+    enough for one SEARCH command. Cached per rule-set version.
+    """
+    key = (server_rules.version, max_length)
+    with _exclusion_cache_lock:
+        cached = _exclusion_cache.get(key)
+    if cached is not None:
+        return cached
+
+    chunks, current, current_length = [], [], 0
+    for term in server_rules.server_search_terms():
+        criterion = f"NOT FROM {_quote_search_string(term)}"
+        if current and current_length + len(criterion) + 1 > max_length:
+            chunks.append(current)
+            current, current_length = [], 0
+        current.append(criterion)
+        current_length += len(criterion) + 1
+    if current:
+        chunks.append(current)
+
+    with _exclusion_cache_lock:
+        _exclusion_cache[key] = chunks
+    return chunks
+
+
+def _tokenize_fetch_items(text, literals):
+    """
+    Tokenize the body of a FETCH response into nested lists.
+    Atoms stay strings, quoted strings are unquoted, NIL becomes None and
+    literal markers are replaced with the literal bytes.
+    """
+    stack = [[]]
+    i, length = 0, len(text)
+    while i < length:
+        ch = text[i]
+        if ch in ' \r\n':
+            i += 1
+        elif ch == '(':
+            stack.append([])
+            i += 1
+        elif ch == ')':
+            if len(stack) > 1:
+                closed = stack.pop()
+                stack[-1].append(closed)
+            i += 1
+        elif ch == '"':
+            i += 1
+            chars = []
+            while i < length and text[i] != '"':
+                if text[i] == '\\' and i + 1 < length:
+                    i += 1
+                chars.append(text[i])
+                i += 1
+            stack[-1].append(''.join(chars))
+            i += 1
+        else:
+            start = i
+            bracket = 0
+            while i < length:
+                c = text[i]
+                if c == '[':
+                    bracket += 1
+                elif c == ']':
+                    bracket -= 1
+                elif bracket == 0 and c in ' ()':
+                    break
+                i += 1
+            atom = text[start:i]
+            marker = _LITERAL_MARKER.match(atom)
+            if marker:
+                stack[-1].append(literals[int(marker.group(1))])
+            elif atom.upper() == 'NIL':
+                stack[-1].append(None)
+            else:
+                stack[-1].append(atom)
+    while len(stack) > 1:
+        closed = stack.pop()
+        stack[-1].append(closed)
+    return stack[0]
+
+
+def _parse_fetch_record(fragments, literals):
+    text = ''.join(fragments)
+    tokens = _tokenize_fetch_items(text, literals)
+    items = tokens[0] if tokens and isinstance(tokens[0], list) else tokens
+    record = {}
+    for i in range(0, len(items) - 1, 2):
+        name = items[i]
+        if isinstance(name, str):
+            record[name.upper()] = items[i + 1]
+    return record
+
+
+def iter_bodystructure_parts(bodystructure, section=''):
+    """
+    Walk a parsed BODYSTRUCTURE and yield (section, content_type, fields)
+    for every leaf part. Section numbers follow RFC 3501, e.g. "1", "2.1".
+    """
+    if not isinstance(bodystructure, list) or not bodystructure:
+        return
+    if isinstance(bodystructure[0], list):
+        index = 0
+        for child in bodystructure:
+            if not isinstance(child, list):
+                break
+            index += 1
+            child_section = f"{section}.{index}" if section else str(index)
+            yield from iter_bodystructure_parts(child, child_section)
+        return
+    maintype = str(bodystructure[0] or '').lower()
+    subtype = str(bodystructure[1] or '').lower() if len(bodystructure) > 1 else ''
+    yield section or '1', f"{maintype}/{subtype}", bodystructure
+
+
+def _bodystructure_params(fields):
+    params = fields[2] if len(fields) > 2 and isinstance(fields[2], list) else []
+    return {
+        str(params[i]).lower(): params[i + 1]
+        for i in range(0, len(params) - 1, 2)
+        if params[i] is not None
+    }
+
+
+def text_part_sections(bodystructure, content_types=TEXT_PART_TYPES):
+    """
+    Return [(section, content_type, encoding, charset)] for the parts of a
+    BODYSTRUCTURE whose type is one of content_types.
+    """
+    sections = []
+    for section, content_type, fields in iter_bodystructure_parts(bodystructure):
+        if content_type not in content_types:
+            continue
+        encoding = fields[5] if len(fields) > 5 else None
+        charset = _bodystructure_params(fields).get('charset')
+        sections.append((section, content_type, encoding, charset))
+    return sections
+
+
+def bodystructure_has_type(bodystructure, content_type):
+    return any(
+        part_type == content_type
+        for _, part_type, _ in iter_bodystructure_parts(bodystructure)
+    )
+
+
+def parse_fetch_response(msg_data):
+    """
+    Parse the data returned by imaplib for a (multi-message) UID FETCH.
+    Returns a dict mapping UID string -> {ITEM NAME: value}, where literal
+    items (RFC822, BODY[...]) are bytes and lists (BODYSTRUCTURE, FLAGS)
+    are nested Python lists.
+    """
+    records = {}
+    fragments, literals = None, None
+
+    def flush():
+        if fragments is None:
+            return
+        record = _parse_fetch_record(fragments, literals)
+        uid = record.get('UID')
+        if uid is not None:
+            records.setdefault(str(uid), {}).update(record)
+
+    for item in msg_data or []:
+        if item is None:
+            continue
+        head, literal = (item[0], item[1]) if isinstance(item, tuple) else (item, None)
+        if _FETCH_START.match(head):
+            flush()
+            head = head.split(b' ', 1)[1]
+            fragments, literals = [], []
+        elif fragments is None:
+            continue
+        if literal is not None:
+            head = _LITERAL_SUFFIX.sub(f' \x00{len(literals)}\x00 '.encode(), head)
+            literals.append(literal)
+        fragments.append(head.decode('utf-8', errors='replace'))
+    flush()
+    return records
+
+
+def drop_attachment_payloads(message):
+    """Empty every leaf part that is not a TEXT_PART_TYPES part, in place."""
+    for part in message.walk():
+        if not part.is_multipart() and part.get_content_type() not in TEXT_PART_TYPES:
+            part.set_payload('')
+    return message
+
+
+class _PushbackReader:
+    """
+    Stands in for imaplib's socket file after IDLE: serves the bytes the
+    raw-socket IDLE reader received past the end of IDLE first, then reads
+    on from the original file.
+    """
+
+    def __init__(self, data, file):
+        self.data = bytearray(data)
+        self.file = file
+
+    def readline(self, limit=-1):
+        if not self.data:
+            return self.file.readline(limit)
+        end = self.data.find(b'\n') + 1 or len(self.data)
+        if limit is not None and limit >= 0:
+            end = min(end, limit)
+        line = bytes(self.data[:end])
+        del self.data[:end]
+        if not line.endswith(b'\n') and not self.data and (limit is None or limit < 0 or len(line) < limit):
+            line += self.file.readline(-1 if limit is None or limit < 0 else limit - len(line))
+        return line
+
+    def read(self, size=-1):
+        if not self.data:
+            return self.file.read(size)
+        if size is None or size < 0:
+            data = bytes(self.data) + self.file.read()
+            self.data.clear()
+            return data
+        data = bytes(self.data[:size])
+        del self.data[:size]
+        if len(data) < size:
+            data += self.file.read(size - len(data))
+        return data
+
+    def __getattr__(self, name):
+        return getattr(self.file, name)
+
+
+class FetchCursor:
+    """
+    Resumable position in a UID snapshot taken once per account run.
+    UIDs are handed out oldest first, so a UIDWatermark over the snapshot
+    advances with every completed batch and a run that stops early keeps
+    the progress it made.
+    """
+
+    def __init__(self, uids, position=0, since_uid=None):
+        self.uids = array('L', sorted(int(uid) for uid in uids))
+        self.position = position
+        self.since_uid = since_uid
+
+    def __len__(self):
+        return len(self.uids)
+
+    @property
+    def remaining(self):
+        return max(len(self.uids) - self.position, 0)
+
+    @property
+    def exhausted(self):
+        return self.remaining == 0
+
+    def peek(self, count):
+        """Next `count` UIDs (oldest first) without moving the cursor."""
+        return list(self.uids[self.position:self.position + count])
+
+    def advance(self, count):
+        self.position = min(self.position + count, len(self.uids))
+
+    def to_dict(self):
+        return {
+            'uids': list(self.uids),
+            'position': self.position,
+            'since_uid': self.since_uid
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data.get('uids', []), data.get('position', 0), data.get('since_uid'))
+
+
+class UIDWatermark:
+    """
+    Tracks which UIDs of a snapshot have been fully processed and exposes the
+    highest UID below which nothing is missing. Batches may complete in any
+    order; the checkpoint only ever moves to `value`.
+    """
+
+    def __init__(self, uids, start_uid=None):
+        self.uids = array('L', sorted(int(uid) for uid in uids))
+        self.index = 0
+        self.done = set()
+        self.value = int(start_uid) if start_uid else 0
+
+    def mark_done(self, uids):
+        """Record processed UIDs. Returns True if the watermark advanced."""
+        self.done.update(int(uid) for uid in uids)
+        advanced = False
+        while self.index < len(self.uids) and self.uids[self.index] in self.done:
+            self.done.discard(self.uids[self.index])
+            self.value = self.uids[self.index]
+            self.index += 1
+            advanced = True
+        return advanced
+
+    @property
+    def complete(self):
+        return self.index >= len(self.uids)
+
 
 class EmailClient:
-    def __init__(self, email_account):
+    def __init__(self, email_account, fetch_mode=None, max_fetch_bytes=None, sender_filter=None, timeout=None,
+                 server_rules=None, initial_sync_days=None):
+        """
+        sender_filter: optional callable(from_header) -> True when the sender
+        is junk. When given, the default fetch mode is headers_first and junk
+        messages are rejected before their bodies are downloaded.
+        timeout: socket timeout in seconds for the IMAP connection.
+        server_rules: optional SenderRules; its blacklists are turned into
+        NOT FROM criteria so known junk is excluded by the server's SEARCH.
+        An account can opt out with server_prefilter: false.
+        initial_sync_days: on a first sync (no checkpoint), only look at
+        mail from the last N days.
+        In stream mode, messages larger than the account's spill_bytes are
+        downloaded in chunks to a temporary file instead of one literal.
+        """
         self.email = email_account['email']
         self.password = email_account['password']
         self.server = email_account['imap_server']
         self.port = email_account['imap_port']
+        self.sender_filter = sender_filter
+        default_mode = FETCH_MODE_HEADERS_FIRST if sender_filter else FETCH_MODE_BATCH
+        self.fetch_mode = fetch_mode or email_account.get('fetch_mode', default_mode)
+        if self.fetch_mode not in FETCH_MODES:
+            raise ValueError(f"Unknown fetch mode: {self.fetch_mode}")
+        if self.fetch_mode == FETCH_MODE_HEADERS_FIRST and not sender_filter:
+            raise ValueError("headers_first fetch mode requires a sender_filter")
+        if max_fetch_bytes is None:
+            max_fetch_bytes = email_account.get('max_fetch_bytes', DEFAULT_MAX_FETCH_BYTES)
+        self.max_fetch_bytes = max_fetch_bytes
+        self.spill_bytes = email_account.get('spill_bytes', DEFAULT_SPILL_BYTES)
+        self.timeout = timeout or email_account.get('imap_timeout')
+        self.server_rules = server_rules if email_account.get('server_prefilter', True) else None
+        self.initial_sync_days = initial_sync_days or email_account.get('initial_sync_days')
+        self.message_count = 0
+        # Checkpointed UIDs are only valid while this stays the same
+        self.uid_validity = None
+        # UIDs whose FETCH failed since the last take_failed_uids()
+        self.failed_uids = set()
         self.mail = None
         self.logger = logging.getLogger(__name__)
 
     def connect(self):
         try:
-            self.mail = imaplib.IMAP4_SSL(self.server, self.port)
+            self.mail = imaplib.IMAP4_SSL(self.server, self.port, timeout=self.timeout)
             self.mail.login(self.email, self.password)
             self.mail.select('inbox')
             status, messages = self.mail.select('inbox')
-            print(f"Total emails in inbox: {messages[0].decode()}")
+            self.message_count = int(messages[0])
+            _, validity = self.mail.response('UIDVALIDITY')
+            if validity and validity[0]:
+                self.uid_validity = int(validity[0])
+            self.logger.info(f"Total emails in inbox for {self.email}: {messages[0].decode()}")
             return True
         except Exception as e:
             self.logger.error(f"Connection failed for {self.email}: {str(e)}")
@@ -32,64 +445,611 @@ class EmailClient:
         except Exception as e:
             self.logger.error(f"Error disconnecting {self.email}: {str(e)}")
 
-    def fetch_emails(self, since_date=None, since_uid=None, batch_size=100, start_index=0):
+    def supports_idle(self):
+        return bool(self.mail) and 'IDLE' in self.mail.capabilities
+
+    def wait_for_new_mail(self, timeout, poll_interval=60, stop_event=None):
+        """
+        Block until the server reports new messages, `timeout` seconds pass or
+        stop_event is set. Uses IMAP IDLE when the server supports it and falls
+        back to NOOP polling every poll_interval seconds.
+        Returns True if the mailbox grew. EXPUNGE responses are counted, so
+        mail arriving after deletions is still seen as growth, and EXISTS
+        responses imaplib collected during earlier commands are checked first.
+        """
+        if self._sync_count():
+            return True
+        if self.supports_idle():
+            return self._idle(timeout, stop_event)
+        return self._poll(timeout, poll_interval, stop_event)
+
+    def _poll(self, timeout, poll_interval, stop_event=None):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            wait = min(poll_interval, max(deadline - time.monotonic(), 0))
+            if stop_event is not None:
+                if stop_event.wait(wait):
+                    return False
+            else:
+                time.sleep(wait)
+            self.mail.noop()
+            if self._sync_count():
+                return True
+        return False
+
+    def _sync_count(self):
+        """Apply the EXPUNGE and EXISTS responses imaplib has collected; True if the mailbox grew."""
+        _, expunged = self.mail.response('EXPUNGE')
+        self.message_count -= sum(1 for item in expunged or [] if item is not None)
+        _, data = self.mail.response('EXISTS')
+        return bool(data) and data[-1] is not None and self._update_count(int(data[-1]))
+
+    def _idle(self, timeout, stop_event=None):
+        """
+        RFC 2177 IDLE. imaplib has no IDLE support before Python 3.14, so the
+        exchange is driven on the raw socket: imaplib's buffered reader is
+        idle between commands, and a read timeout on it would poison it.
+        """
+        sock = self.mail.sock
+        tag = self.mail._new_tag()
+        buffer = bytearray()
+        new_mail = False
+
+        self.mail.send(tag + b' IDLE\r\n')
+        handshake_deadline = time.monotonic() + (self.timeout or 30)
+        while True:
+            line = self._read_raw_line(sock, buffer, handshake_deadline)
+            if line is None:
+                raise self.mail.abort('no IDLE continuation from server')
+            if line.startswith(b'+'):
+                break
+            if line.startswith(tag):
+                # Server refused IDLE after advertising it, poll instead
+                self.logger.warning(f"IDLE rejected for {self.email}: {line!r}")
+                return self._poll(timeout, 60, stop_event)
+            new_mail = self._check_exists(line) or new_mail
+
+        deadline = time.monotonic() + timeout
+        while not new_mail:
+            line = self._read_raw_line(sock, buffer, deadline, stop_event)
+            if line is None:
+                break
+            new_mail = self._check_exists(line)
+
+        self.mail.send(b'DONE\r\n')
+        done_deadline = time.monotonic() + (self.timeout or 30)
+        while True:
+            line = self._read_raw_line(sock, buffer, done_deadline)
+            if line is None:
+                raise self.mail.abort('no response to IDLE DONE')
+            if line.startswith(tag):
+                break
+            new_mail = self._check_exists(line) or new_mail
+        if buffer:
+            # Whatever the server sent after the tagged reply belongs to imaplib
+            self.mail.file = _PushbackReader(buffer, self.mail.file)
+        return new_mail
+
+    def _check_exists(self, line):
+        if _EXPUNGE_RESPONSE.match(line):
+            self.message_count -= 1
+            return False
+        match = _EXISTS_RESPONSE.match(line)
+        return bool(match) and self._update_count(int(match.group(1)))
+
+    def _update_count(self, count):
+        grew = count > self.message_count
+        self.message_count = count
+        return grew
+
+    @staticmethod
+    def _read_raw_line(sock, buffer, deadline, stop_event=None):
+        """Read one CRLF-terminated line from sock; None on deadline or stop."""
+        while b'\n' not in buffer:
+            if stop_event is not None and stop_event.is_set():
+                return None
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return None
+            pending = sock.pending() if hasattr(sock, 'pending') else 0
+            if not pending:
+                ready, _, _ = select.select([sock], [], [], min(remaining, 1.0))
+                if not ready:
+                    continue
+            chunk = sock.recv(65536)
+            if not chunk:
+                raise imaplib.IMAP4.abort('connection closed during IDLE')
+            buffer.extend(chunk)
+        index = buffer.index(b'\n')
+        line = bytes(buffer[:index + 1]).rstrip(b'\r\n')
+        del buffer[:index + 1]
+        return line
+
+    def snapshot_uids(self, since_uid=None, since_date=None):
+        """
+        Run UID SEARCH once and return a FetchCursor over the matching UIDs.
+        With server_rules the search excludes known junk senders; long
+        exclusion lists are split over several SEARCH commands whose results
+        are intersected. Excluded messages that carry a text/calendar part
+        are added back, matching the calendar bypass of the client filter.
+        Returns None if the search fails.
+        """
+        # Update: fetch after last UID, not including it again
+        next_uid = None
+        if since_uid:
+            # since_uid may be str, ensure int
+            try:
+                next_uid = int(since_uid) + 1
+            except Exception:
+                next_uid = None
+
+        base = []
+        if next_uid:
+            base.append(f'UID {next_uid}:*')
+        else:
+            if since_date is None and self.initial_sync_days:
+                since_date = date.today() - timedelta(days=int(self.initial_sync_days))
+            if since_date is not None:
+                base.append(f'SINCE {imap_date(since_date)}')
+
+        uids = self._search_uids(base)
+        if uids is None:
+            return None
+        if next_uid:
+            # "n:*" always matches the highest UID, even when it is below n
+            uids = {uid for uid in uids if uid >= next_uid}
+
+        chunks = build_exclusion_criteria(self.server_rules) if self.server_rules else []
+        kept = uids
+        for chunk in chunks:
+            found = self._search_uids(base + chunk)
+            if found is None:
+                return None
+            kept = kept & found
+        excluded = uids - kept
+        if excluded:
+            kept = kept | self._calendar_uids(excluded)
+        return FetchCursor(kept, since_uid=since_uid)
+
+    def _search_uids(self, keys):
+        criteria = f"({' '.join(keys)})" if keys else "ALL"
+        status, messages = self.mail.uid('search', None, criteria)
+        if status != 'OK':
+            return None
+        return {int(uid) for uid in messages[0].split()}
+
+    def _calendar_uids(self, uids):
+        """UIDs among `uids` with a text/calendar part; a failed lookup keeps the whole chunk."""
+        found = set()
+        for chunk in self._split_by_set_length([str(uid) for uid in uids]):
+            status, msg_data = self.mail.uid('fetch', compress_uid_set(chunk), '(UID BODYSTRUCTURE)')
+            if status != 'OK':
+                found.update(int(uid) for uid in chunk)
+                continue
+            records = parse_fetch_response(msg_data)
+            found.update(
+                int(uid) for uid in chunk
+                if uid not in records or bodystructure_has_type(records[uid].get('BODYSTRUCTURE'), 'text/calendar')
+            )
+        return found
+
+    def fetch_emails(self, since_date=None, since_uid=None, batch_size=100, cursor=None):
         """
         Fetch emails in batches for efficiency.
-        Returns a tuple: (emails, next_start_index)
+        The UID list is searched once, on the first call, and then paged
+        through with the returned cursor.
+        Returns a tuple: (emails, next_cursor); next_cursor is None when done.
+        The whole batch is held in memory; in stream mode, iter_batches
+        hands the messages out one at a time instead.
         """
         if not self.mail:
             if not self.connect():
                 return [], None
 
         try:
-            # Search criteria
-            # Update: fetch after last UID, not including it again
-            if since_uid:
-                # since_uid may be str, ensure int
-                try:
-                    next_uid = int(since_uid) + 1
-                except Exception:
-                    next_uid = since_uid  # fallback, but should be int
-                criteria = f'(UID {next_uid}:*)'
+            if cursor is None:
+                cursor = self.snapshot_uids(since_uid, since_date)
+                if cursor is None:
+                    return [], None
+
+            batch_ids = [str(uid) for uid in cursor.peek(batch_size)]
+            if not batch_ids:
+                return [], None
+
+            if self.fetch_mode == FETCH_MODE_SINGLE:
+                emails = self._fetch_one_by_one(batch_ids)
+            elif self.fetch_mode in (FETCH_MODE_HEADERS_FIRST, FETCH_MODE_PARTS):
+                emails = self._fetch_headers_first(batch_ids)
+            elif self.fetch_mode == FETCH_MODE_STREAM:
+                if self.sender_filter:
+                    emails = self._fetch_headers_first(batch_ids)
+                else:
+                    emails = list(self.iter_emails(batch_ids))
             else:
-                criteria = "ALL"
+                emails = self._fetch_batch(batch_ids)
+
+            cursor.advance(len(batch_ids))
+            return emails, (None if cursor.exhausted else cursor)
+        except Exception as e:
+            self.logger.error(f"Error fetching emails for {self.email}: {str(e)}")
+            return [], None
+
+    def take_failed_uids(self):
+        """
+        UIDs (as strings) whose FETCH failed since the last call. Callers
+        leave them out of the UIDs they mark done, so the checkpoint stops
+        below them and they are fetched again on the next run.
+        """
+        failed, self.failed_uids = self.failed_uids, set()
+        return failed
+
+    def _fetch_failed(self, kind, uids):
+        uids = [uid.decode() if isinstance(uid, bytes) else str(uid) for uid in uids]
+        self.logger.warning(f"{kind} fetch failed for {self.email} ({len(uids)} messages)")
+        self.failed_uids.update(uids)
 
-            # status, messages = self.mail.search(None, criteria)
-            status, messages = self.mail.uid('search', None, criteria)
+    def _fetch_one_by_one(self, batch_ids):
+        """One UID FETCH round trip per message."""
+        emails = []
+        for email_id in batch_ids:
+            status, msg_data = self.mail.uid('fetch', email_id, '(RFC822)')
 
             if status != 'OK':
-                return [], None
+                self._fetch_failed("Single", [email_id])
+                continue
+            raw_email = msg_data[0][1]
+            email_message = email.message_from_bytes(raw_email)
+            emails.append({
+                'uid': email_id.decode() if isinstance(email_id, bytes) else str(email_id),
+                'message': email_message,
+                'raw': raw_email
+            })
+        return emails
 
-            email_ids = messages[0].split()
-            total_emails = len(email_ids)
-            if total_emails == 0 or start_index >= total_emails:
-                return [], None
+    def _fetch_batch(self, batch_ids, sizes=None):
+        """
+        Fetch the whole batch with as few UID FETCH commands as possible.
+        Each command covers a UID sequence set whose estimated size stays
+        under max_fetch_bytes. Results keep the order of batch_ids.
+        sizes: RFC822.SIZE per UID, if already known.
+        """
+        uids = [email_id.decode() if isinstance(email_id, bytes) else str(email_id) for email_id in batch_ids]
+        fetched = {}
+        for chunk in self._plan_fetch_commands(uids, sizes):
+            status, msg_data = self.mail.uid('fetch', compress_uid_set(chunk), '(RFC822)')
+            if status != 'OK':
+                self._fetch_failed("Batch", chunk)
+                continue
+            fetched.update(parse_fetch_response(msg_data))
+
+        emails = []
+        for uid in uids:
+            raw_email = fetched.get(uid, {}).get('RFC822')
+            if not isinstance(raw_email, bytes):
+                continue
+            emails.append({
+                'uid': uid,
+                'message': email.message_from_bytes(raw_email),
+                'raw': raw_email
+            })
+        return emails
+
+    def iter_batches(self, cursor, batch_size=100):
+        """
+        Generator of (batch_uids, records) over the remaining UIDs of the
+        cursor, oldest first, for stream mode. records is a lazy iterator
+        (see iter_emails), so the caller decides how many parsed messages
+        are held at once; with a sender_filter, the header-only records of
+        rejected messages come first. The cursor moves past a batch when
+        the caller asks for the next one.
+        """
+        while not cursor.exhausted:
+            batch_uids = cursor.peek(batch_size)
+            yield batch_uids, self._iter_batch([str(uid) for uid in batch_uids])
+            cursor.advance(len(batch_uids))
+
+    def _iter_batch(self, uids):
+        if not self.sender_filter:
+            yield from self.iter_emails(uids)
+            return
+        headers, survivors, rejected, sizes = self._prefilter(uids)
+        yield from rejected.values()
+        structures = {uid: headers[uid][1] for uid in survivors if uid in headers}
+        yield from self.iter_emails(survivors, structures, sizes)
+
+    def iter_emails(self, batch_ids, structures=None, sizes=None):
+        """
+        Generator over the messages of batch_ids, one record at a time, for
+        memory-bounded processing of large mailboxes.
+
+        Each FETCH command covers at most max_fetch_bytes of messages, and
+        each message's raw bytes are dropped as soon as it is parsed: records
+        carry 'raw': None, and attachment payloads are emptied since only
+        the text parts are read downstream. Messages above spill_bytes are
+        fetched after the others, one at a time: only their header block and
+        text parts (from the BODYSTRUCTURE, looked up unless given in
+        structures), or, without a BODYSTRUCTURE, the whole message in
+        SPILL_CHUNK_BYTES pieces through a temp file. sizes: RFC822.SIZE per
+        UID from the header fetch; only missing ones are looked up.
+        """
+        uids = [email_id.decode() if isinstance(email_id, bytes) else str(email_id) for email_id in batch_ids]
+        sizes = dict(sizes or {})
+        missing = [uid for uid in uids if uid not in sizes]
+        if missing and (self.max_fetch_bytes or self.spill_bytes):
+            sizes.update(self._fetch_sizes(missing))
+        spilled = {uid for uid in uids if self.spill_bytes and sizes.get(uid, 0) > self.spill_bytes}
 
-            # Batch slicing
-            end_index = min(start_index + batch_size, total_emails)
-            batch_ids = email_ids[-end_index: -start_index] if start_index > 0 else email_ids[-end_index:]
-            batch_ids = list(reversed(batch_ids))  # newest first
+        for chunk in self._plan_fetch_commands([uid for uid in uids if uid not in spilled], sizes):
+            status, msg_data = self.mail.uid('fetch', compress_uid_set(chunk), '(RFC822)')
+            if status != 'OK':
+                self._fetch_failed("Stream", chunk)
+                continue
+            fetched = parse_fetch_response(msg_data)
+            del msg_data
+            for uid in chunk:
+                raw_email = fetched.pop(uid, {}).get('RFC822')
+                if not isinstance(raw_email, bytes):
+                    continue
+                message = drop_attachment_payloads(email.message_from_bytes(raw_email))
+                del raw_email
+                yield {'uid': uid, 'message': message, 'raw': None}
 
-            emails = []
-            for email_id in batch_ids:
-                # 
-                status, msg_data = self.mail.uid('fetch', email_id, '(RFC822)')
+        structures = dict(structures or {})
+        missing = [uid for uid in spilled if not isinstance(structures.get(uid), list)]
+        if missing:
+            structures.update(self._fetch_structures(missing))
+        for uid in sorted(spilled, key=int):
+            record = self._fetch_spilled(uid, sizes[uid], structures.get(uid))
+            if record:
+                yield record
 
+    def _fetch_spilled(self, uid, size, bodystructure=None):
+        """
+        Fetch one large message without its attachments: the header block
+        and text parts named by its BODYSTRUCTURE. Without one, download the
+        whole message in partial fetches to a temp file and parse it from there.
+        """
+        if isinstance(bodystructure, list):
+            records = self._fetch_text_parts([uid], {uid: bodystructure})
+            return records[0] if records else None
+        with tempfile.TemporaryFile() as spool:
+            offset = 0
+            while offset < size:
+                status, msg_data = self.mail.uid('fetch', uid, f'(BODY.PEEK[]<{offset}.{SPILL_CHUNK_BYTES}>)')
                 if status != 'OK':
+                    self._fetch_failed("Chunked", [uid])
+                    return None
+                record = parse_fetch_response(msg_data).get(uid, {})
+                chunk = next(
+                    (value for name, value in record.items()
+                     if name.startswith('BODY[]') and isinstance(value, bytes)),
+                    b''
+                )
+                if not chunk:
+                    break
+                spool.write(chunk)
+                offset += len(chunk)
+            spool.seek(0)
+            message = drop_attachment_payloads(email.message_from_binary_file(spool))
+        return {'uid': uid, 'message': message, 'raw': None}
+
+    def _fetch_headers_first(self, batch_ids):
+        """
+        Two-phase fetch. Phase one downloads only the sender-related headers
+        and BODYSTRUCTURE and runs sender_filter on them; phase two downloads
+        full messages for the survivors only.
+
+        Rejected messages are still returned, as header-only records flagged
+        'prefiltered', so callers see every UID of the batch and can move the
+        checkpoint past them. Calendar invites always survive phase one,
+        matching the calendar bypass in MLRecruiterFilter.
+
+        In parts mode phase two only downloads the text parts listed in the
+        BODYSTRUCTURE, and the sender filter is optional. In stream mode it
+        goes through iter_emails.
+        """
+        uids = [email_id.decode() if isinstance(email_id, bytes) else str(email_id) for email_id in batch_ids]
+        headers, survivors, rejected, sizes = self._prefilter(uids)
+        structures = {uid: headers[uid][1] for uid in survivors if uid in headers}
+        if self.fetch_mode == FETCH_MODE_PARTS:
+            fetched = self._fetch_text_parts(survivors, structures)
+        elif self.fetch_mode == FETCH_MODE_STREAM:
+            fetched = list(self.iter_emails(survivors, structures, sizes))
+        else:
+            fetched = self._fetch_batch(survivors, sizes)
+        downloaded = {record['uid']: record for record in fetched} if survivors else {}
+
+        emails = []
+        for uid in uids:
+            record = downloaded.get(uid) or rejected.get(uid)
+            if record:
+                emails.append(record)
+        return emails
+
+    def _prefilter(self, uids):
+        """
+        Phase one of the headers-first fetch. Returns (headers, survivors,
+        rejected, sizes): the _fetch_headers result, the UIDs whose bodies
+        are needed, {uid: header-only record} for the rejected ones, and
+        RFC822.SIZE per UID.
+        """
+        sizes = {}
+        headers = self._fetch_headers(uids, sizes)
+        survivors, rejected = [], {}
+        for uid in uids:
+            record = headers.get(uid)
+            if record is None:
+                # Header fetch failed for this UID, fall back to a full fetch
+                survivors.append(uid)
+                continue
+            header_message, bodystructure, header_bytes = record
+            if bodystructure_has_type(bodystructure, 'text/calendar') or not self.sender_filter:
+                survivors.append(uid)
+            elif self.sender_filter(header_message.get('From', '')):
+                rejected[uid] = {
+                    'uid': uid,
+                    'message': header_message,
+                    'raw': header_bytes,
+                    'prefiltered': True
+                }
+            else:
+                survivors.append(uid)
+
+        self.logger.info(
+            f"Header pre-filter for {self.email}: {len(rejected)} of {len(uids)} messages rejected before body download"
+        )
+        return headers, survivors, rejected, sizes
+
+    def _fetch_text_parts(self, uids, structures):
+        """
+        Download the header block and only the text/plain, text/html and
+        text/calendar sections of each message, and wrap them in a
+        PartialMessage. Messages sharing the same section list are fetched
+        with one command. UIDs without a BODYSTRUCTURE fall back to RFC822.
+        """
+        plans, groups, fallback = {}, {}, []
+        for uid in uids:
+            bodystructure = structures.get(uid)
+            if not isinstance(bodystructure, list):
+                fallback.append(uid)
+                continue
+            plans[uid] = text_part_sections(bodystructure)
+            key = tuple(section for section, _, _, _ in plans[uid])
+            groups.setdefault(key, []).append(uid)
+
+        fetched = {}
+        for sections, group in groups.items():
+            items = ' '.join(['UID', 'BODY.PEEK[HEADER]'] + [f'BODY.PEEK[{section}]' for section in sections])
+            for chunk in self._split_by_set_length(group):
+                status, msg_data = self.mail.uid('fetch', compress_uid_set(chunk), f'({items})')
+                if status != 'OK':
+                    self._fetch_failed("Part", chunk)
                     continue
-                raw_email = msg_data[0][1]
-                email_message = email.message_from_bytes(raw_email)
-                emails.append({
-                    'uid': email_id.decode() if isinstance(email_id, bytes) else str(email_id),
-                    'message': email_message,
-                    'raw': raw_email
-                })
-
-            next_start_index = end_index if end_index < total_emails else None
-            return emails, next_start_index
-        except Exception as e:
-            self.logger.error(f"Error fetching emails for {self.email}: {str(e)}")
-            return [], None
+                fetched.update(parse_fetch_response(msg_data))
+
+        emails = []
+        for uid in uids:
+            if uid not in plans or uid not in fetched:
+                continue
+            record = fetched[uid]
+            parts = [
+                MessagePart(content_type, record.get(f'BODY[{section}]'), encoding, charset, section)
+                for section, content_type, encoding, charset in plans[uid]
+            ]
+            bodystructure = structures[uid]
+            multipart = isinstance(bodystructure[0], list)
+            if multipart:
+                subtype = next((field for field in bodystructure if isinstance(field, str)), 'mixed')
+                content_type = f"multipart/{subtype.lower()}"
+            else:
+                content_type = f"{str(bodystructure[0]).lower()}/{str(bodystructure[1]).lower()}"
+            emails.append({
+                'uid': uid,
+                'message': PartialMessage(record.get('BODY[HEADER]'), parts, multipart, content_type),
+                'raw': None
+            })
+        if fallback:
+            emails.extend(self._fetch_batch(fallback))
+        return emails
+
+    def _fetch_headers(self, uids, sizes=None):
+        """
+        Return {uid: (header_message, bodystructure, header_bytes)}, and
+        fill the optional sizes dict with RFC822.SIZE per UID.
+        """
+        headers = {}
+        for chunk in self._split_by_set_length(uids):
+            status, msg_data = self.mail.uid('fetch', compress_uid_set(chunk), HEADER_FETCH_ITEMS)
+            if status != 'OK':
+                self.logger.warning(f"Header fetch failed for {self.email} ({len(chunk)} messages)")
+                continue
+            for uid, record in parse_fetch_response(msg_data).items():
+                if sizes is not None and record.get('RFC822.SIZE') is not None:
+                    try:
+                        sizes[uid] = int(record['RFC822.SIZE'])
+                    except (TypeError, ValueError):
+                        pass
+                header_bytes = next(
+                    (value for name, value in record.items()
+                     if name.startswith('BODY[HEADER') and isinstance(value, bytes)),
+                    None
+                )
+                if header_bytes is None:
+                    continue
+                headers[uid] = (
+                    email.message_from_bytes(header_bytes),
+                    record.get('BODYSTRUCTURE'),
+                    header_bytes
+                )
+        return headers
+
+    def _fetch_structures(self, uids):
+        """Return {uid: BODYSTRUCTURE} for the given UIDs; failed lookups are left out."""
+        structures = {}
+        for chunk in self._split_by_set_length(uids):
+            status, msg_data = self.mail.uid('fetch', compress_uid_set(chunk), '(UID BODYSTRUCTURE)')
+            if status != 'OK':
+                continue
+            for uid, record in parse_fetch_response(msg_data).items():
+                structures[uid] = record.get('BODYSTRUCTURE')
+        return structures
+
+    def _fetch_sizes(self, uids):
+        """Return {uid: RFC822.SIZE} for the given UIDs in one round trip."""
+        sizes = {}
+        for chunk in self._split_by_set_length(uids):
+            status, msg_data = self.mail.uid('fetch', compress_uid_set(chunk), '(RFC822.SIZE)')
+            if status != 'OK':
+                continue
+            for uid, record in parse_fetch_response(msg_data).items():
+                try:
+                    sizes[uid] = int(record.get('RFC822.SIZE', 0))
+                except (TypeError, ValueError):
+                    continue
+        return sizes
+
+    def _plan_fetch_commands(self, uids, sizes=None):
+        """
+        Group UIDs into FETCH commands. A group is closed when adding the next
+        message would exceed max_fetch_bytes; a single oversized message is
+        fetched on its own. sizes: RFC822.SIZE per UID, if already known.
+        """
+        if not self.max_fetch_bytes:
+            return self._split_by_set_length(uids)
+
+        sizes = dict(sizes or {})
+        missing = [uid for uid in uids if uid not in sizes]
+        if missing:
+            sizes.update(self._fetch_sizes(missing))
+        groups, current, current_bytes = [], [], 0
+        for uid in sorted(uids, key=int):
+            size = sizes.get(uid, 0)
+            if current and current_bytes + size > self.max_fetch_bytes:
+                groups.append(current)
+                current, current_bytes = [], 0
+            current.append(uid)
+            current_bytes += size
+        if current:
+            groups.append(current)
+
+        commands = []
+        for group in groups:
+            commands.extend(self._split_by_set_length(group))
+        return commands
+
+    @staticmethod
+    def _split_by_set_length(uids, max_length=MAX_UID_SET_LENGTH):
+        """Split UIDs so that each compressed sequence set fits in max_length."""
+        chunks, current = [], []
+        for uid in sorted(uids, key=int):
+            current.append(uid)
+            if len(current) > 1 and len(compress_uid_set(current)) > max_length:
+                current.pop()
+                chunks.append(current)
+                current = [uid]
+        if current:
+            chunks.append(current)
+        return chunks
 
     @staticmethod
     def clean_text(text):
@@ -101,4 +1061,4 @@ class EmailClient:
                 return decoded_text.decode('utf-8', errors='ignore')
             return str(decoded_text)
         except:
-            return str(text)
\ No newline at end of file
+            return str(text)
@@ -0,0 +1,95 @@
+import re
+import phonenumbers
+
+# One pass over the text; alternatives are tried in order at each position,
+# so a URL or address is consumed whole before its digits can look like a phone.
+# The phone group only locates digit runs; PhoneNumberMatcher decides what they hold.
+_ENTITY = re.compile(
+    r"(?P<linkedin>https?://(?:[a-z]{2,3}\.)?linkedin\.com/in/(?P<linkedin_id>[a-z0-9\-_]+)[^\s\"'<>]*)"
+    r"|(?P<url>https?://[^\s\"'<>]+)"
+    r"|(?P<email>[a-z0-9_.+-]+@[a-z0-9-]+\.[a-z0-9-.]+)"
+    r"|(?P<phone>(?<![\w@])[+(]?\d(?:[ \t.()/-]{0,3}\d){6,14})",
+    re.IGNORECASE
+)
+
+# Characters before a phone candidate searched for a label
+PHONE_LABEL_WINDOW = 24
+# Characters of the same line on each side of a digit run that PhoneNumberMatcher
+# sees, so it can tell dates and times ("2025-03-18 14:00") from numbers
+PHONE_CONTEXT_CHARS = 16
+PHONE_LENIENCY = phonenumbers.Leniency.VALID
+_PHONE_LABEL = re.compile(r"\b(?:phone|tel|cell|mobile|mob|direct|ph|call|text|whatsapp|[mcto])\b\W*$", re.IGNORECASE)
+_FAX_LABEL = re.compile(r"\bfax\b\W*$", re.IGNORECASE)
+
+# Addresses nobody answers, and inline image content IDs that look like addresses
+_UNREPLIABLE_EMAIL = re.compile(
+    r"^(?:no-?reply|do-?not-?reply|notifications?|mailer-daemon|postmaster|bounces?|unsubscribe)\b"
+    r"|\.(?:png|jpe?g|gif)@",
+    re.IGNORECASE
+)
+
+
+def _rank(candidates):
+    """Values ordered by score (highest first, then first seen), without duplicates."""
+    scores = {}
+    for value, score in candidates:
+        scores[value] = max(score, scores.get(value, score))
+    # sorted() is stable, so dict (first seen) order breaks ties
+    return sorted(scores, key=scores.get, reverse=True)
+
+
+def _phone_score(text, start):
+    context = text[max(0, start - PHONE_LABEL_WINDOW):start]
+    if _FAX_LABEL.search(context):
+        return -1
+    return 1 if _PHONE_LABEL.search(context) else 0
+
+
+def _phones_in_span(text, start, end, region):
+    """(position, E.164) of each valid number the matcher finds overlapping text[start:end]."""
+    line_start = text.rfind("\n", 0, start) + 1
+    line_end = text.find("\n", end)
+    if line_end == -1:
+        line_end = len(text)
+    window_start = max(line_start, start - PHONE_CONTEXT_CHARS)
+    window = text[window_start:min(line_end, end + PHONE_CONTEXT_CHARS)]
+    for match in phonenumbers.PhoneNumberMatcher(window, region, leniency=PHONE_LENIENCY):
+        match_start = window_start + match.start
+        if match_start < end and window_start + match.end > start:
+            yield match_start, phonenumbers.format_number(match.number, phonenumbers.PhoneNumberFormat.E164)
+
+
+def scan_entities(text, region="US"):
+    """
+    Scan cleaned body text once for contact details. Returns ranked
+    candidates, best first:
+
+        {"emails": [...], "phones": [E.164, ...], "linkedin_ids": [...], "urls": [...]}
+
+    The scan only locates runs of digits; phonenumbers.PhoneNumberMatcher
+    then reads each run with the rest of its line around it, which splits
+    neighbouring numbers and drops dates and times. Labelled numbers ("Cell:",
+    "Tel") rank ahead of bare ones and fax numbers last; no-reply style
+    addresses rank after personal ones.
+    """
+    text = text or ""
+    emails, phones, linkedin_ids, urls = [], [], [], []
+    for match in _ENTITY.finditer(text):
+        kind = match.lastgroup
+        if kind == "linkedin":
+            linkedin_ids.append((match.group("linkedin_id"), 0))
+            urls.append((match.group("linkedin"), 0))
+        elif kind == "url":
+            urls.append((match.group("url").rstrip(".,;:)"), 0))
+        elif kind == "email":
+            address = match.group("email").rstrip(".-")
+            emails.append((address, -1 if _UNREPLIABLE_EMAIL.search(address) else 0))
+        elif kind == "phone":
+            for start, number in _phones_in_span(text, match.start(), match.end(), region):
+                phones.append((number, _phone_score(text, start)))
+    return {
+        "emails": _rank(emails),
+        "phones": _rank(phones),
+        "linkedin_ids": _rank(linkedin_ids),
+        "urls": _rank(urls),
+    }
@@ -1,100 +1,205 @@
+import logging
+import threading
+from collections import Counter
 import spacy
-from bs4 import BeautifulSoup
-import phonenumbers
 import re
 from email.utils import parseaddr
-from icalendar import Calendar
+from body_cleaner import clean_body
+from entity_scanner import scan_entities
+from parsed_email import ParsedEmail
+from simhash import SimHashIndex
 
-class NERContactExtractor:
-    def __init__(self, model="en_core_web_sm"):
-        self.nlp = spacy.load(model)
-        self.email_regex = re.compile(r"[a-zA-Z0-9_.+-]+@[a-zA-Z0-9-]+\.[a-zA-Z0-9-.]+")
-        self.linkedin_regex = re.compile(
-            r"https?://(?:[a-z]{2,3}\.)?linkedin\.com/in/([a-zA-Z0-9\-_]+)",
-            re.IGNORECASE
-        )
-        self.url_pattern = re.compile(r'https?://[^\s"\']+')
+# Only doc.ents is used; these components are never needed for NER
+NER_EXCLUDED_PIPES = ["tagger", "parser", "lemmatizer", "attribute_ruler"]
 
-    def clean_body(self, html):
-        soup = BeautifulSoup(html, "html.parser")
-        text = soup.get_text(separator="\n")
-        text = re.split(r"On .+ wrote:", text)[0]
-        return text.strip()
-
-    def extract_contacts(self, email_message, source_email=None):
-        calendar_email = self._extract_calendar_email(email_message)
-
-        raw_body = self._get_email_body(email_message)
-        body = self.clean_body(raw_body)
-        doc = self.nlp(body)
-
-        name = self._extract_name(doc, body, email_message=email_message)
-        email = calendar_email or self._extract_email(body)
-        phone = self._extract_phone(body)
-        linkedin = self._extract_linkedin(body)
-        sender_email = email_message.get("From")
-        company = self._extract_company(doc, body, email=email, linkedin=linkedin, sender_email=sender_email)
-        return {
-            "name": name,
-            "email": email,
-            "phone": phone,
-            "company": company,
-            "linkedin_id": linkedin,
-            "source": source_email if source_email else None
-        }
+class NERContactExtractor:
+    def __init__(self, model="en_core_web_sm", batch_size=64, n_process=1, max_ner_chars=5000,
+                 template_cache_size=5000, template_distance=7):
+        self.nlp = spacy.load(model, exclude=NER_EXCLUDED_PIPES)
+        self.batch_size = batch_size
+        self.n_process = n_process
+        self.max_ner_chars = max_ner_chars
+        self.logger = logging.getLogger(__name__)
+        self.tier_counts = Counter()
+        self._stats_lock = threading.Lock()
+        # Body names of recent messages per sender, reused for near-duplicate templates
+        self.templates = SimHashIndex(template_cache_size, template_distance) if template_cache_size else None
+
+    def clean_body(self, text, is_html=False):
+        return clean_body(text, is_html=is_html)
 
     def _get_email_body(self, email_message):
-        if email_message.is_multipart():
-            for part in email_message.walk():
-                if part.get_content_type() == 'text/plain' and part.get_payload(decode=True):
-                    return part.get_payload(decode=True).decode('utf-8', errors='ignore')
-        else:
-            return email_message.get_payload(decode=True).decode('utf-8', errors='ignore')
-        return ""
+        return ParsedEmail.wrap(email_message).body
+
     def _extract_calendar_email(self, email_message):
-        """Extract ORGANIZER and ATTENDEE emails from calendar invites (regex only)."""
+        """
+        Extract ORGANIZER and ATTENDEE emails from calendar invites (regex only),
+        falling back to the Sender, Reply-To and From addresses.
+        Returns (emails or None, tier) with tier "calendar" or "header".
+        """
+        parsed = ParsedEmail.wrap(email_message)
         emails = set()
 
-        if email_message.is_multipart():
-            for part in email_message.walk():
-                if part.get_content_type() == "text/calendar":
-                    try:
-                        payload = part.get_payload(decode=True).decode("utf-8", errors="ignore")
+        for payload in parsed.calendars:
+            try:
+                for match in re.findall(r"ORGANIZER.*mailto:([^ \r\n]+)", payload, re.IGNORECASE):
+                    emails.add(match.lower())
 
-                        for match in re.findall(r"ORGANIZER.*mailto:([^ \r\n]+)", payload, re.IGNORECASE):
-                            emails.add(match.lower())
+                for match in re.findall(r"ATTENDEE.*mailto:([^ \r\n]+)", payload, re.IGNORECASE):
+                    emails.add(match.lower())
 
-                        for match in re.findall(r"ATTENDEE.*mailto:([^ \r\n]+)", payload, re.IGNORECASE):
-                            emails.add(match.lower())
+            except Exception as e:
+                self.logger.error(f"Calendar parsing error: {e}")
 
-                    except Exception as e:
-                        print("Calendar parsing error:", e)
+        if emails:
+            return list(emails), "calendar"
 
-        if not emails:
-            for header in ["Sender", "Reply-To", "From"]:
-                if header in email_message:
-                    _, addr = parseaddr(email_message.get(header))
-                    if addr and "noreply" not in addr.lower():
-                        emails.add(addr.lower())
+        for header in ["Sender", "Reply-To", "From"]:
+            if header in parsed:
+                _, addr = parseaddr(parsed.get(header))
+                if addr and "noreply" not in addr.lower():
+                    emails.add(addr.lower())
 
-        return list(emails) if emails else None
+        return (list(emails), "header") if emails else (None, None)
 
 
     def extract_contacts(self, email_message, source_email=None):
-        calendar_emails = self._extract_calendar_email(email_message)
+        return self.extract_contacts_batch([email_message], source_email=source_email)[0]
 
-        raw_body = self._get_email_body(email_message)
-        body = self.clean_body(raw_body)
-        doc = self.nlp(body)
+    def extract_contacts_batch(self, messages, source_email=None):
+        """
+        Extract contacts for a batch of messages (email.message.Message or
+        ParsedEmail; a ParsedEmail reuses the body the filter already cleaned).
+        Header, calendar and regex extractors run first; the NER model only
+        sees the messages whose name is still unresolved, in one nlp.pipe
+        call. A message from the same sender address within a few bits of a
+        recent template reuses that template's body name and skips NER;
+        email, phone and LinkedIn are always scanned from its own body.
+        Returns a list aligned with `messages`; entries are None for
+        messages that could not be processed.
+        """
+        prepared = []
+        for email_message in messages:
+            try:
+                email_message = ParsedEmail.wrap(email_message)
+                calendar_emails, calendar_tier = self._extract_calendar_email(email_message)
+                header_name = self._name_from_header(email_message)
+                body = email_message.clean_body(self.clean_body)
+                template = self._cached_template(email_message, header_name)
+                prepared.append((email_message, body, calendar_emails, calendar_tier, header_name, template))
+            except Exception as e:
+                self.logger.error(f"Error preparing email for extraction: {e}")
+                prepared.append(None)
+
+        needs_ner = [i for i, item in enumerate(prepared) if item is not None and not item[4] and not item[5]]
+        docs = {}
+        if needs_ner:
+            texts = [self._ner_text(prepared[i][1]) for i in needs_ner]
+            docs = dict(zip(needs_ner, self.nlp.pipe(texts, batch_size=self.batch_size, n_process=self.n_process)))
+
+        contacts = []
+        for i, item in enumerate(prepared):
+            if item is None:
+                contacts.append(None)
+                continue
+            email_message, body, calendar_emails, calendar_tier, header_name, template = item
+            try:
+                contacts.append(self._build_contact(
+                    email_message, body, docs.get(i), calendar_emails, source_email,
+                    header_name=header_name, template=template, calendar_tier=calendar_tier
+                ))
+            except Exception as e:
+                self.logger.error(f"Error extracting contact: {e}")
+                contacts.append(None)
+        return contacts
+
+    def _cached_template(self, email_message, header_name):
+        """Template of a near-duplicate message from the same sender, if it covers what this one needs."""
+        if self.templates is None:
+            return None
+        sender = self._sender_address(email_message)
+        template = self.templates.get(
+            email_message.fingerprint(self.clean_body), match=lambda template: template["sender"] == sender
+        )
+        if template is None:
+            return None
+        # A template built from a message with a header name never looked for a body name
+        if not (header_name or template["name_known"]):
+            return None
+        return template
+
+    @staticmethod
+    def _sender_address(email_message):
+        _, address = parseaddr(email_message.get("From") or "")
+        return address.lower()
+
+    def _template_fields(self, email_message, body, doc, header_name):
+        """
+        The body name, the costly field shared by copies of a template. It
+        is only reused for mail from the same sender address, since
+        colleagues at one company send the same template with their own
+        signature.
+        """
+        name, name_tier = (None, None) if header_name else self._resolve_name(doc, body)
+        return {
+            "sender": self._sender_address(email_message),
+            "name": name,
+            "name_tier": name_tier,
+            "name_known": not header_name,
+        }
 
-        name = self._extract_name(doc, body, email_message=email_message)
+    def template_stats(self):
+        return self.templates.stats() if self.templates is not None else {}
 
-        email = (calendar_emails[0] if calendar_emails else None) or self._extract_email(body)
+    def _ner_text(self, body):
+        # Names sit near the top or in the signature; NER cost grows with length
+        return body[:self.max_ner_chars]
 
-        phone = self._extract_phone(body)
-        linkedin = self._extract_linkedin(body)
+    def _record_tier(self, field, tier):
+        with self._stats_lock:
+            self.tier_counts[(field, tier or "unresolved")] += 1
+
+    def extraction_stats(self):
+        """
+        How often each tier resolved each field, e.g.
+        {"name": {"header": 120, "ner": 14, "signature": 3, "unresolved": 9}}
+        """
+        with self._stats_lock:
+            stats = {}
+            for (field, tier), count in self.tier_counts.items():
+                stats.setdefault(field, {})[tier] = count
+            return stats
+
+    def _build_contact(self, email_message, body, doc, calendar_emails, source_email=None, header_name=None,
+                       template=None, calendar_tier="calendar"):
+        reused = template is not None
+        if not reused:
+            template = self._template_fields(email_message, body, doc, header_name)
+            if self.templates is not None:
+                self.templates.put(ParsedEmail.wrap(email_message).fingerprint(self.clean_body), template)
+
+        if header_name:
+            name, name_tier = header_name, "header"
+        else:
+            name = template["name"]
+            name_tier = ("template" if reused else template["name_tier"]) if name else None
+        self._record_tier("name", name_tier)
+
+        entities = scan_entities(body)
+        email = calendar_emails[0] if calendar_emails else None
+        email_tier = calendar_tier if email else None
+        if not email:
+            email = next(iter(entities["emails"]), None)
+            email_tier = "regex" if email else None
+        self._record_tier("email", email_tier)
+
+        phone = next(iter(entities["phones"]), None)
+        self._record_tier("phone", "regex" if phone else None)
+        linkedin = next(iter(entities["linkedin_ids"]), None)
+        self._record_tier("linkedin_id", "regex" if linkedin else None)
         sender_email = email_message.get("From")
         company = self._extract_company(doc, body, email=email, linkedin=linkedin, sender_email=sender_email)
+        self._record_tier("company", "domain" if company else None)
 
         return {
             "name": name,
@@ -106,46 +211,44 @@ class NERContactExtractor:
             "source": source_email if source_email else None
         }
 
-    def _extract_name(self, doc, text, email_message=None):
+    def _name_from_header(self, email_message):
         if email_message:
             from_header = email_message.get("From")
             if from_header:
                 name, _ = parseaddr(from_header)
                 if name and len(name.split()) <= 3:
                     return name.strip()
+        return None
+
+    def _extract_name(self, doc, text, email_message=None):
+        name, _ = self._resolve_name(doc, text, email_message=email_message)
+        return name
+
+    def _resolve_name(self, doc, text, email_message=None, header_name=None):
+        """Returns (name, tier). doc may be None when NER was skipped."""
+        name = header_name or self._name_from_header(email_message)
+        if name:
+            return name, "header"
 
-        for ent in doc.ents:
-            if ent.label_ == "PERSON" and len(ent.text.split()) <= 3:
-                return ent.text.strip()
+        if doc is not None:
+            for ent in doc.ents:
+                if ent.label_ == "PERSON" and len(ent.text.split()) <= 3:
+                    return ent.text.strip(), "ner"
 
         match = re.search(r"(Thanks|Regards|Best),?\s*\n([A-Z][a-z]+ [A-Z][a-z]+)", text)
         if match:
-            return match.group(2).strip()
+            return match.group(2).strip(), "signature"
 
-        return None
+        return None, None
 
     def _extract_email(self, text):
-        match = re.search(r"[a-zA-Z0-9_.+-]+@[a-zA-Z0-9-]+\.[a-zA-Z0-9-.]+", text)
-        return match.group(0) if match else None
+        return next(iter(scan_entities(text)["emails"]), None)
 
     def _extract_phone(self, text):
-        for match in phonenumbers.PhoneNumberMatcher(text, "US"):
-            return phonenumbers.format_number(match.number, phonenumbers.PhoneNumberFormat.E164)
-        return None
+        return next(iter(scan_entities(text)["phones"]), None)
 
     def _extract_linkedin(self, text):
-        match = self.linkedin_regex.search(text)
-        if match:
-            return match.group(1)  
-        return None
-
-
-    class YourClass:
-        def __init__(self):
-            self.linkedin_regex = re.compile(
-                r'https?://(?:www\.)?linkedin\.com/in/([A-Za-z0-9-]+)',
-                re.IGNORECASE
-            )
+        return next(iter(scan_entities(text)["linkedin_ids"]), None)
 
     def _extract_company(self, doc, text, email=None, linkedin=None, sender_email=None):
         """
@@ -1,15 +1,184 @@
-import joblib
+import hashlib
+import json
 import os
 import re
+import struct
 import logging
-from typing import Dict, List, Set
+import numpy as np
+import yaml
+from collections import Counter
+from typing import Dict, List, Tuple
+from parsed_email import ParsedEmail
+from sender_rules import SenderRules
+from simhash import SimHashIndex
+
+# Rule lists that config/rules.yaml may override
+RULE_LIST_KEYS = ("blacklist_keywords", "personal_domains", "service_domains", "exact_email_blacklist")
+
+FROM_ADDRESS_PATTERN = re.compile(r'(?:<|\(|^)([\w\.-]+@[\w\.-]+)(?:>|\)|$)', re.IGNORECASE)
+
+# Subdirectory of model_dir holding the NumPy inference artifact, and its manifest
+INFERENCE_DIR = "inference"
+INFERENCE_META = "meta.json"
+
+_UINT32 = 0xFFFFFFFF
+
+
+def murmurhash3_32(data: bytes, seed: int = 0) -> int:
+    """Signed 32-bit MurmurHash3 (x86), as scikit-learn's HashingVectorizer computes it."""
+    c1, c2 = 0xcc9e2d51, 0x1b873593
+    h = seed & _UINT32
+    block_end = len(data) - len(data) % 4
+    for (k,) in struct.iter_unpack('<I', data[:block_end]):
+        k = (k * c1) & _UINT32
+        k = ((k << 15) | (k >> 17)) & _UINT32
+        h ^= (k * c2) & _UINT32
+        h = ((h << 13) | (h >> 19)) & _UINT32
+        h = (h * 5 + 0xe6546b64) & _UINT32
+    k = 0
+    for i, byte in enumerate(data[block_end:]):
+        k |= byte << (8 * i)
+    if k:
+        k = (k * c1) & _UINT32
+        k = ((k << 15) | (k >> 17)) & _UINT32
+        h ^= (k * c2) & _UINT32
+    h ^= len(data)
+    h ^= h >> 16
+    h = (h * 0x85ebca6b) & _UINT32
+    h ^= h >> 13
+    h = (h * 0xc2b2ae35) & _UINT32
+    h ^= h >> 16
+    return h - (1 << 32) if h & 0x80000000 else h
+
+
+def vocabulary_hash(term: str) -> int:
+    """Stable 64-bit key of a vocabulary term, for the sorted-array vocabulary."""
+    return int.from_bytes(hashlib.blake2b(term.encode('utf-8'), digest_size=8).digest(), 'little')
+
+
+class LinearTextModel:
+    """
+    Binary linear text classifier scored with NumPy only, from the artifact
+    train_classifier.py exports next to the pickles.
+
+    The weight vector, IDF array and vocabulary (sorted 64-bit term hashes
+    with their columns) are .npy files opened with mmap, so loading costs
+    no unpickling and no scikit-learn import, and forked workers share the
+    pages. Hashed models need no vocabulary: terms map to columns with the
+    same MurmurHash3 as HashingVectorizer. Scores match the pickled
+    vectorizer + classifier for word analyzers with l2 normalisation.
+    """
+
+    def __init__(self, path):
+        with open(os.path.join(path, INFERENCE_META), 'r') as f:
+            meta = json.load(f)
+        files = meta['files']
+
+        def load(name):
+            return np.load(os.path.join(path, files[name]), mmap_mode='r') if name in files else None
+
+        self.kind = meta['kind']
+        self.n_features = int(meta['n_features'])
+        self.intercept = float(meta['intercept'])
+        self.lowercase = meta['lowercase']
+        self.ngram_range = tuple(meta['ngram_range'])
+        self.token_pattern = re.compile(meta['token_pattern'])
+        self.weights = load('weights')
+        self.idf = load('idf')
+        self.vocab_hashes = load('vocab_hashes')
+        self.vocab_columns = load('vocab_columns')
+
+    def _terms(self, text):
+        tokens = self.token_pattern.findall(text.lower() if self.lowercase else text)
+        low, high = self.ngram_range
+        if high == 1:
+            return tokens
+        terms = list(tokens) if low == 1 else []
+        for n in range(max(2, low), high + 1):
+            terms.extend(" ".join(tokens[i:i + n]) for i in range(len(tokens) - n + 1))
+        return terms
+
+    def _columns(self, terms):
+        """Column of each term, -1 for terms outside the vocabulary."""
+        if self.kind == 'hashed':
+            columns = []
+            for term in terms:
+                h = murmurhash3_32(term.encode('utf-8'))
+                columns.append((2 ** 31 if h == -2 ** 31 else abs(h)) % self.n_features)
+            return np.asarray(columns, dtype=np.int64)
+
+        hashes = np.fromiter((vocabulary_hash(term) for term in terms), dtype=np.uint64, count=len(terms))
+        positions = np.searchsorted(self.vocab_hashes, hashes).clip(max=len(self.vocab_hashes) - 1)
+        found = self.vocab_hashes[positions] == hashes
+        return np.where(found, self.vocab_columns[positions], -1).astype(np.int64)
+
+    def predict_proba(self, texts):
+        """Recruiter probability per text, from one sparse dot product over the batch."""
+        n = len(texts)
+        # One (row, term, count) entry per distinct term of each text; each term is looked up once per batch
+        rows, term_ids, counts, index = [], [], [], {}
+        for row, text in enumerate(texts):
+            for term, count in Counter(self._terms(text)).items():
+                rows.append(row)
+                term_ids.append(index.setdefault(term, len(index)))
+                counts.append(count)
+        columns = self._columns(list(index))[np.asarray(term_ids, dtype=np.int64)] if index else np.zeros(0, np.int64)
+        rows = np.asarray(rows, dtype=np.int64)
+        values = np.asarray(counts, dtype=np.float64)
+
+        known = columns >= 0
+        # Terms sharing a column (hash collisions) add up, as in the sparse matrix
+        keys, inverse = np.unique(rows[known] * self.n_features + columns[known], return_inverse=True)
+        values = np.bincount(inverse, weights=values[known], minlength=len(keys))
+        rows, columns = keys // self.n_features, keys % self.n_features
+        if self.idf is not None:
+            values = values * self.idf[columns]
+
+        norms = np.sqrt(np.bincount(rows, weights=values * values, minlength=n))
+        dots = np.bincount(rows, weights=values * self.weights[columns], minlength=n)
+        scores = np.divide(dots, norms, out=np.zeros(n), where=norms > 0) + self.intercept
+        return 1.0 / (1.0 + np.exp(-scores))
+
+
+class PickledTextModel:
+    """The joblib-pickled vectorizer and classifier, for model dirs without an exported artifact."""
 
-class MLRecruiterFilter:
     def __init__(self, model_dir):
+        import joblib
         self.classifier = joblib.load(os.path.join(model_dir, "classifier.pkl"))
+        # A fitted TfidfVectorizer, or a stateless HashingVectorizer from train_classifier.py --mode hashed
         self.vectorizer = joblib.load(os.path.join(model_dir, "vectorizer.pkl"))
+        # Column of predict_proba holding the recruiter (label 1) class
+        self._positive_index = list(self.classifier.classes_).index(1)
+
+    def predict_proba(self, texts):
+        features = self.vectorizer.transform(texts)
+        return self.classifier.predict_proba(features)[:, self._positive_index]
+
+
+def load_text_model(model_dir):
+    """The NumPy artifact under model_dir/inference when exported, else the pickles."""
+    inference_dir = os.path.join(model_dir, INFERENCE_DIR)
+    if os.path.exists(os.path.join(inference_dir, INFERENCE_META)):
+        return LinearTextModel(inference_dir)
+    return PickledTextModel(model_dir)
+
+
+class MLRecruiterFilter:
+    def __init__(self, model_dir, threshold=0.5, rules_path=None, verdict_cache_size=10000,
+                 template_cache_size=5000, template_distance=7):
+        self.model = load_text_model(model_dir)
+        self.threshold = threshold
         self.logger = logging.getLogger(__name__)
+        self.verdict_cache_size = verdict_cache_size
+        # Verdicts of recently classified bodies, reused for near-duplicate templates
+        self.templates = SimHashIndex(template_cache_size, template_distance) if template_cache_size else None
+        if rules_path is None:
+            base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+            rules_path = os.path.join(base_dir, 'config', 'rules.yaml')
         self._initialize_filter_lists()
+        self._load_rules_file(rules_path)
+        self._compile_rules()
 
     def _initialize_filter_lists(self):
         self.blacklist_keywords = {
@@ -58,91 +227,130 @@ class MLRecruiterFilter:
         )
 
 
+    def _load_rules_file(self, rules_path):
+        """
+        Override the default rule lists from config/rules.yaml. Each list
+        given in the file replaces the built-in one; missing keys keep the
+        defaults. junk_pattern is a regex string.
+        """
+        if not rules_path or not os.path.exists(rules_path):
+            return
+        try:
+            with open(rules_path, 'r', encoding='utf-8-sig') as file:
+                rules = yaml.safe_load(file) or {}
+        except Exception as e:
+            self.logger.error(f"Error loading sender rules from {rules_path}: {e}")
+            return
+
+        for key in RULE_LIST_KEYS:
+            if rules.get(key) is not None:
+                setattr(self, key, {str(value).lower() for value in rules[key]})
+        if rules.get('junk_pattern'):
+            self.junk_pattern = re.compile(rules['junk_pattern'], re.IGNORECASE)
+        self.logger.info(f"Loaded sender rules from {rules_path}")
+
+    def _compile_rules(self):
+        self.sender_rules = SenderRules(
+            self.blacklist_keywords,
+            self.personal_domains,
+            self.service_domains,
+            self.exact_email_blacklist,
+            self.junk_pattern,
+            cache_size=self.verdict_cache_size
+        )
+
     def _extract_clean_email(self, from_header: str) -> str:
 
         if not from_header:
             return ""
-        email_match = re.search(
-            r'(?:<|\(|^)([\w\.-]+@[\w\.-]+)(?:>|\)|$)', 
-            from_header,
-            re.IGNORECASE
-        )
+        email_match = FROM_ADDRESS_PATTERN.search(from_header)
         return email_match.group(1).lower() if email_match else ""
 
     def should_ignore_email(self, email: str) -> bool:
-
-        email = email.lower().strip()
-        if not re.match(r"[^@]+@[^@]+\.[^@]+", email):
-            return True  
-
-        if email in self.exact_email_blacklist:
-            return True
-
-        local_part, domain = email.split("@", 1)
-
-        if any(kw in local_part for kw in self.blacklist_keywords):
-            return True
-
-        if domain in self.personal_domains or domain in self.service_domains:
-            return True
-
-        for black in self.exact_email_blacklist:
-            if black in email or domain == black or local_part.startswith(black):
-                return True
-
-        return False
+        return self.sender_rules.should_ignore(email)
 
     def is_junk_email(self, from_header: str) -> bool:
         """Comprehensive junk detection using all specified rules"""
         email = self._extract_clean_email(from_header)
         if not email:
             return True
-            
-        if self.should_ignore_email(email):
-            return True
-            
-        local_part, domain = email.split("@", 1)
-        if domain in self.service_domains:
-            return True
-            
-        if self.junk_pattern.match(email):
-            return True
-            
-        return False
+
+        return self.sender_rules.is_junk(email)
 
     def is_recruiter(self, subject: str, body: str, from_email: str) -> bool:
         """ML classification with full junk filtering"""
         if self.is_junk_email(from_email):
             return False
-            
-        features = self.vectorizer.transform([f"{subject} {body} {from_email}"])
-        return self.classifier.predict(features)[0] == 1
+
+        return self.classify_batch([(subject, body, from_email)])[0][0]
+
+    def predict_proba(self, texts: List[str]) -> List[float]:
+        """Recruiter probability for each text, scored as one batch."""
+        if not texts:
+            return []
+        return [float(p) for p in self.model.predict_proba(texts)]
+
+    def classify_batch(self, items: List[Tuple[str, str, str]], threshold: float = None) -> List[Tuple[bool, float]]:
+        """
+        Score (subject, body, from_email) triples in one vectorised pass.
+        Junk checks are left to the caller. Returns (is_recruiter, probability)
+        per item, using `threshold` or the filter's default decision threshold.
+        """
+        threshold = self.threshold if threshold is None else threshold
+        texts = [f"{subject} {body} {from_email}" for subject, body, from_email in items]
+        return [(p >= threshold, p) for p in self.predict_proba(texts)]
 
     def filter_recruiter_emails(self, emails: List[Dict], extractor) -> List[Dict]:
-        """Complete filtering pipeline"""
-        filtered = []
-        
-        for email_data in emails:
+        """
+        Complete filtering pipeline. Calendar invites bypass the classifier;
+        a message within a few bits of a recently classified template reuses
+        its verdict, and every other non-junk message of the batch is scored
+        in one classify_batch call. Keeps the input order and stores the
+        score on email_data['recruiter_probability'].
+        """
+        keep = [False] * len(emails)
+        candidates, candidate_items, fingerprints = [], [], []
+
+        for i, email_data in enumerate(emails):
             try:
-                msg = email_data['message']
-                from_header = msg.get('From', '')
-                subject = msg.get('Subject', '')
+                # Already rejected by the header-first fetch, body was never downloaded
+                if email_data.get('prefiltered'):
+                    continue
+
+                parsed = email_data.get('parsed') or ParsedEmail(email_data['message'])
+                email_data['parsed'] = parsed
+                from_header = parsed.get('From', '')
+                subject = parsed.get('Subject', '')
 
                 # ✅ If it's a calendar invite, bypass ML filter
-                if any(part.get_content_type() == "text/calendar" for part in msg.walk()):
-                    filtered.append(email_data)
+                if parsed.has_calendar:
+                    keep[i] = True
                     continue
 
                 if not self.is_junk_email(from_header):
-                    body = extractor.clean_body(
-                        extractor._get_email_body(msg)
-                    )
-                    if self.is_recruiter(subject, body, from_header):
-                        filtered.append(email_data)
+                    fingerprint = parsed.fingerprint(extractor.clean_body) if self.templates is not None else None
+                    cached = self.templates.get(fingerprint) if fingerprint is not None else None
+                    if cached is not None:
+                        keep[i], email_data['recruiter_probability'] = cached
+                        continue
+                    body = parsed.clean_body(extractor.clean_body)
+                    candidates.append(i)
+                    candidate_items.append((subject, body, from_header))
+                    fingerprints.append(fingerprint)
             except Exception as e:
                 self.logger.error(f"Error processing email: {str(e)}")
-                
-        return filtered
+
+        try:
+            results = self.classify_batch(candidate_items)
+            for i, fingerprint, (is_recruiter, probability) in zip(candidates, fingerprints, results):
+                emails[i]['recruiter_probability'] = probability
+                keep[i] = is_recruiter
+                if fingerprint is not None:
+                    self.templates.put(fingerprint, (is_recruiter, probability))
+        except Exception as e:
+            self.logger.error(f"Error classifying batch: {str(e)}")
+
+        return [email_data for i, email_data in enumerate(emails) if keep[i]]
     
     def filter_non_junk_emails(self, emails: List[Dict], extractor) -> List[Dict]:
         """
@@ -152,17 +360,19 @@ class MLRecruiterFilter:
         filtered = []
         for email_data in emails:
             try:
-                msg = email_data['message']
-                from_header = msg.get('From', '')
+                if email_data.get('prefiltered'):
+                    continue
+
+                parsed = email_data.get('parsed') or ParsedEmail(email_data['message'])
+                email_data['parsed'] = parsed
+                from_header = parsed.get('From', '')
 
                 # Skip junk senders
                 if self.is_junk_email(from_header):
                     continue
 
                 # Keep everything else (real companies, vendors, recruiters, etc.)
-                body = extractor.clean_body(
-                    extractor._get_email_body(msg)
-                )
+                body = parsed.clean_body(extractor.clean_body)
                 email_data['clean_body'] = body
                 filtered.append(email_data)
 
@@ -182,7 +392,7 @@ class MLRecruiterFilter:
         if domain in self.personal_domains:
             return None
             
-        if any(kw in local_part for kw in self.blacklist_keywords):
+        if self.sender_rules.has_blacklisted_keyword(local_part):
             return None
             
         return f"https://{domain}"
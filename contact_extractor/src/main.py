@@ -1,10 +1,17 @@
+import argparse
+import asyncio
 import yaml
 import logging
 import os
-from email_client import EmailClient
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from async_email_client import AsyncEmailClient
+from dedup_index import DedupIndex
+from email_client import FETCH_MODE_STREAM, EmailClient, UIDWatermark
 from extractor import NERContactExtractor
 from filters import MLRecruiterFilter
 from storage import StorageManager
+from write_behind import WriteBehindStorage
 
 logging.basicConfig(
     level=logging.INFO,
@@ -12,6 +19,25 @@ logging.basicConfig(
     handlers=[logging.StreamHandler()]
 )
 
+# Concurrent runner settings
+MAX_CONCURRENT_ACCOUNTS = int(os.getenv('MAX_CONCURRENT_ACCOUNTS', 8))
+ACCOUNT_TIMEOUT_SECONDS = float(os.getenv('ACCOUNT_TIMEOUT_SECONDS', 1800))
+IMAP_TIMEOUT_SECONDS = float(os.getenv('IMAP_TIMEOUT_SECONDS', 60))
+BACKFILL_CONNECTIONS = int(os.getenv('BACKFILL_CONNECTIONS', 4))
+NER_BATCH_SIZE = int(os.getenv('NER_BATCH_SIZE', 64))
+NER_PROCESSES = int(os.getenv('NER_PROCESSES', 1))
+# Stream fetch mode: messages parsed and held at once while a batch is processed
+STREAM_CHUNK_SIZE = int(os.getenv('STREAM_CHUNK_SIZE', 20))
+RECRUITER_THRESHOLD = float(os.getenv('RECRUITER_THRESHOLD', 0.5))
+# Only look this far back on an account's first sync (unset = whole mailbox)
+INITIAL_SYNC_DAYS = int(os.getenv('INITIAL_SYNC_DAYS', 0)) or None
+# Write contacts and activity counts from a background thread (0 = write inline)
+WRITE_BEHIND = os.getenv('WRITE_BEHIND', '1') != '0'
+# Cross-account index of already processed messages (0 = disabled)
+DEDUP_INDEX = os.getenv('DEDUP_INDEX', '1') != '0'
+DEDUP_TTL_DAYS = float(os.getenv('DEDUP_TTL_DAYS', 30))
+DEDUP_MAX_ENTRIES = int(os.getenv('DEDUP_MAX_ENTRIES', 200000))
+
 def load_accounts(filter_tags=None):
     try:
         base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
@@ -42,82 +68,307 @@ def deduplicate_contacts(contacts):
     seen = set()
     unique_contacts = []
     for contact in contacts:
-        key = (contact['email'].lower(), contact.get('company', '').lower())
+        key = ((contact.get('email') or '').lower(), (contact.get('company') or '').lower())
         if key not in seen:
             seen.add(key)
             unique_contacts.append(contact)
     return unique_contacts
 
-def process_account(account, storage, extractor, email_filter, batch_size=100):
-    email_client = EmailClient(account)
-    if not email_client.connect():
-        logging.error(f"Failed to connect to {account['email']}")
-        return
+def analyse_batch(emails, account, extractor, email_filter, dedup_index=None):
+    """
+    Filter and extract one fetched batch for an account.
+    With a dedup_index, messages already processed in any account reuse the
+    stored verdict and contact, and the outcome for the rest is recorded.
+    Returns (deduplicated contacts, number of recruiter emails).
+    """
+    cached = []
+    if dedup_index is not None:
+        cached, emails = dedup_index.partition(emails)
 
+    recruiter_emails = email_filter.filter_recruiter_emails(emails, extractor)
+    contacts, extracted = [], None
     try:
-        last_run = storage.load_last_run()
-        account_last_run = last_run.get(account['email'], {})
-        last_uid = account_last_run.get('last_uid')
+        extracted = extractor.extract_contacts_batch(
+            [email_data.get('parsed') or email_data['message'] for email_data in recruiter_emails],
+            source_email=account['email']
+        )
+        contacts = [contact for contact in extracted if contact and contact.get('email')]
+    except Exception as e:
+        logging.error(f"Error extracting contacts: {e}")
 
-        start_index = 0
-        max_uid_seen = int(last_uid) if last_uid else 0
-        total_extracted = 0
+    recruiter_count = len(recruiter_emails)
+    if dedup_index is not None:
+        dedup_index.record_batch(emails, recruiter_emails, extracted)
+        for entry in cached:
+            if not entry['is_recruiter']:
+                continue
+            recruiter_count += 1
+            contact = entry['contact']
+            if contact and contact.get('email'):
+                contacts.append(dict(contact, source=account['email']))
+
+    return deduplicate_contacts(contacts), recruiter_count
+
+def process_batch(emails, account, storage, extractor, email_filter, dedup_index=None):
+    """
+    Filter, extract and store one fetched batch for an account.
+    A failing batch is logged and skipped rather than failing the account,
+    so the checkpoint does not stay stuck below it.
+    Returns the number of contacts saved.
+    """
+    try:
+        contacts, recruiter_count = analyse_batch(emails, account, extractor, email_filter, dedup_index)
+    except Exception as e:
+        logging.error(f"Error analysing {len(emails)} messages for {account['email']}, skipping them: {e}")
+        return 0
+    if contacts:
+        storage.save_contacts(account['email'], contacts)
+
+    storage.log_email_activity(account['email'], recruiter_count)
+    return len(contacts)
+
+def _iter_chunks(records, chunk_size):
+    chunk = []
+    for record in records:
+        chunk.append(record)
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+def _fetch_batches(email_client, cursor, last_uid, batch_size, chunk_size):
+    """
+    (batch_uids, chunks of fetched records) per batch. Nothing is fetched
+    until the chunks are iterated. In stream mode the messages are fetched
+    and parsed chunk_size at a time; other modes fetch the whole batch as
+    one chunk.
+    """
+    if email_client.fetch_mode == FETCH_MODE_STREAM:
+        for batch_uids, records in email_client.iter_batches(cursor, batch_size):
+            yield batch_uids, _iter_chunks(records, chunk_size)
+        return
+    while not cursor.exhausted:
+        yield cursor.peek(batch_size), _fetch_whole_batch(email_client, cursor, last_uid, batch_size)
+
+def _fetch_whole_batch(email_client, cursor, last_uid, batch_size):
+    # fetch_emails advances the cursor, or leaves it alone when the fetch fails
+    emails, _ = email_client.fetch_emails(since_uid=last_uid, batch_size=batch_size, cursor=cursor)
+    if emails:
+        yield emails
+
+def drain_account(email_client, account, storage, extractor, email_filter, batch_size=100, deadline=None,
+                  dedup_index=None, chunk_size=STREAM_CHUNK_SIZE):
+    """
+    Process every message after the account's checkpoint on an already
+    connected EmailClient. The checkpoint only moves past UIDs for which
+    every earlier UID of the snapshot has been processed, so stopping early
+    never skips mail.
+    deadline: time.monotonic() value after which no new batch is started;
+    the checkpoint stays at the highest fully processed UID.
+    chunk_size: in stream mode, how many parsed messages are held at once.
+    Returns the number of contacts extracted.
+    """
+    last_uid = storage.resolve_last_uid(account['email'], email_client.uid_validity)
+
+    cursor = email_client.snapshot_uids(last_uid)
+    if cursor is None or cursor.exhausted:
+        return 0
+    watermark = UIDWatermark(cursor.uids, start_uid=last_uid)
+    total_extracted = 0
+
+    for batch_uids, chunks in _fetch_batches(email_client, cursor, last_uid, batch_size, chunk_size):
+        if deadline is not None and time.monotonic() >= deadline:
+            logging.warning(
+                f"Timed out processing {account['email']} with {cursor.remaining} messages left; "
+                f"checkpoint held at UID {watermark.value}, the rest will be picked up next run"
+            )
+            break
+
+        fetched = 0
+        for emails in chunks:
+            fetched += len(emails)
+            total_extracted += process_batch(emails, account, storage, extractor, email_filter, dedup_index)
+        if not fetched:
+            break
 
-        while True:
-            emails, next_start_index = email_client.fetch_emails(
-                since_uid=last_uid, batch_size=batch_size, start_index=start_index
+        failed = email_client.take_failed_uids()
+        if failed:
+            logging.warning(
+                f"{len(failed)} messages of {account['email']} could not be fetched; "
+                f"the checkpoint stays below them"
             )
-            if not emails:
-                break
-
-            recruiter_emails = email_filter.filter_recruiter_emails(emails, extractor)
-            contacts = []
-            for email_data in recruiter_emails:
-                try:
-                    contact = extractor.extract_contacts(email_data['message'], source_email=account['email'])
-                    if contact.get('email'):
-                        contacts.append(contact)
-                except Exception as e:
-                    logging.error(f"Error extracting contact: {e}")
-                    continue
-
-            contacts = deduplicate_contacts(contacts)
-            if contacts:
-                storage.save_contacts(account['email'], contacts)
-                total_extracted += len(contacts)
-
-            storage.log_email_activity(account['email'], len(recruiter_emails))
-
-            batch_uids = [int(email['uid']) for email in emails if email.get('uid')]
-            if batch_uids:
-                max_uid_seen = max(max_uid_seen, max(batch_uids))
-                storage.save_last_run(account['email'], str(max_uid_seen))
-
-            if not next_start_index:
-                break
-            start_index = next_start_index
+            batch_uids = [uid for uid in batch_uids if str(uid) not in failed]
+        if watermark.mark_done(batch_uids):
+            storage.save_last_run(account['email'], str(watermark.value), email_client.uid_validity)
 
+    return total_extracted
+
+def process_account(account, storage, extractor, email_filter, batch_size=100, deadline=None, imap_timeout=None,
+                    dedup_index=None):
+    """
+    Fetch, filter, extract and store new mail for one account.
+    deadline: time.monotonic() value after which no new batch is started.
+    Returns the number of contacts extracted, or None if the account failed.
+    """
+    email_client = EmailClient(
+        account,
+        sender_filter=email_filter.is_junk_email,
+        timeout=imap_timeout,
+        server_rules=email_filter.sender_rules,
+        initial_sync_days=INITIAL_SYNC_DAYS
+    )
+    if not email_client.connect():
+        logging.error(f"Failed to connect to {account['email']}")
+        return None
+
+    try:
+        total_extracted = drain_account(
+            email_client, account, storage, extractor, email_filter,
+            batch_size=batch_size, deadline=deadline, dedup_index=dedup_index
+        )
         logging.info(f"Completed processing for {account['email']}. Total contacts extracted: {total_extracted}")
+        return total_extracted
 
     except Exception as e:
         logging.error(f"Error processing account {account['email']}: {e}")
+        return None
     finally:
         email_client.disconnect()
 
+def run_accounts(accounts, storage, extractor, email_filter,
+                 max_workers=MAX_CONCURRENT_ACCOUNTS, account_timeout=ACCOUNT_TIMEOUT_SECONDS,
+                 imap_timeout=IMAP_TIMEOUT_SECONDS, dedup_index=None):
+    """
+    Process accounts concurrently with a bounded thread pool.
+    All workers share the same extractor and filter. A failing or slow
+    account only affects itself: each one gets its own deadline and IMAP
+    socket timeout, and exceptions are contained per account.
+    """
+    results = {}
+
+    def worker(account):
+        logging.info(f"Processing account: {account['email']}")
+        deadline = time.monotonic() + account_timeout if account_timeout else None
+        return process_account(
+            account, storage, extractor, email_filter,
+            deadline=deadline, imap_timeout=imap_timeout, dedup_index=dedup_index
+        )
+
+    with ThreadPoolExecutor(max_workers=max(1, max_workers), thread_name_prefix='account') as pool:
+        futures = {pool.submit(worker, account): account['email'] for account in accounts}
+        for future in as_completed(futures):
+            account_email = futures[future]
+            try:
+                results[account_email] = future.result()
+            except Exception as e:
+                logging.error(f"Worker for {account_email} crashed: {e}")
+                results[account_email] = None
+
+    failed = [account_email for account_email, extracted in results.items() if extracted is None]
+    logging.info(
+        f"Processed {len(results)} accounts: {len(results) - len(failed)} succeeded, {len(failed)} failed, "
+        f"{sum(extracted or 0 for extracted in results.values())} contacts extracted"
+    )
+    if failed:
+        logging.warning(f"Failed accounts: {', '.join(failed)}")
+    return results
+
+async def backfill_account_async(account, storage, extractor, email_filter,
+                                 connections=BACKFILL_CONNECTIONS, batch_size=100, dedup_index=None):
+    """
+    Backfill one mailbox over several parallel IMAP connections.
+    Batches finish out of order, so the checkpoint is only moved to the
+    highest UID below which every message has been processed.
+    """
+    client = AsyncEmailClient(account, connections=connections, batch_size=batch_size,
+                              timeout=IMAP_TIMEOUT_SECONDS)
+    if not await client.connect():
+        logging.error(f"Failed to connect to {account['email']}")
+        return None
+
+    try:
+        last_uid = storage.resolve_last_uid(account['email'], client.uid_validity)
+        cursor = await client.snapshot_uids(last_uid)
+        watermark = UIDWatermark(cursor.uids, start_uid=last_uid)
+        logging.info(f"Backfilling {len(cursor)} messages for {account['email']} over {len(client.connections)} connections")
+
+        total_extracted = 0
+        async for emails, batch_uids in client.iter_batches(cursor):
+            total_extracted += await asyncio.to_thread(
+                process_batch, emails, account, storage, extractor, email_filter, dedup_index
+            )
+            if watermark.mark_done(batch_uids):
+                storage.save_last_run(account['email'], str(watermark.value), client.uid_validity)
+
+        if not watermark.complete:
+            logging.warning(
+                f"Backfill for {account['email']} incomplete; checkpoint held at UID {watermark.value}"
+            )
+        logging.info(f"Completed backfill for {account['email']}. Total contacts extracted: {total_extracted}")
+        return total_extracted
+    except Exception as e:
+        logging.error(f"Error backfilling account {account['email']}: {e}")
+        return None
+    finally:
+        await client.disconnect()
+
+def backfill_account(account, storage, extractor, email_filter, connections=BACKFILL_CONNECTIONS, dedup_index=None):
+    return asyncio.run(backfill_account_async(
+        account, storage, extractor, email_filter, connections=connections, dedup_index=dedup_index
+    ))
+
+def create_storage():
+    storage = StorageManager()
+    return WriteBehindStorage(storage) if WRITE_BEHIND else storage
+
+def create_dedup_index():
+    if not DEDUP_INDEX:
+        return None
+    base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    return DedupIndex(
+        os.path.join(base_dir, 'data', 'dedup_index.db'),
+        ttl_seconds=DEDUP_TTL_DAYS * 86400, max_entries=DEDUP_MAX_ENTRIES
+    )
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Extract recruiter contacts from candidate mailboxes")
+    parser.add_argument('--backfill', action='store_true',
+                        help="backfill accounts one by one over several IMAP connections each")
+    parser.add_argument('--connections', type=int, default=BACKFILL_CONNECTIONS,
+                        help="IMAP connections per mailbox in backfill mode")
+    return parser.parse_args()
+
 def main():
+    args = parse_args()
     logging.info(" Starting email contact extraction...")
     accounts = load_accounts(filter_tags=["job_search"])
     if not accounts:
         logging.error("No active accounts found")
         return
 
-    storage = StorageManager()
-    extractor = NERContactExtractor()
-    email_filter = MLRecruiterFilter(model_dir="../models")
+    storage = create_storage()
+    extractor = NERContactExtractor(batch_size=NER_BATCH_SIZE, n_process=NER_PROCESSES)
+    email_filter = MLRecruiterFilter(model_dir="../models", threshold=RECRUITER_THRESHOLD)
+    dedup_index = create_dedup_index()
 
-    for account in accounts:
-        logging.info(f"Processing account: {account['email']}")
-        process_account(account, storage, extractor, email_filter)
+    try:
+        if args.backfill:
+            for account in accounts:
+                backfill_account(account, storage, extractor, email_filter, connections=args.connections,
+                                 dedup_index=dedup_index)
+        else:
+            run_accounts(accounts, storage, extractor, email_filter, dedup_index=dedup_index)
+    finally:
+        storage.close()
+
+    logging.info(f"Extraction tiers: {extractor.extraction_stats()}")
+    logging.info(
+        f"Template caches: filter {email_filter.templates.stats() if email_filter.templates else {}}, "
+        f"extractor {extractor.template_stats()}"
+    )
+    if dedup_index is not None:
+        logging.info(f"Dedup index: {dedup_index.stats()}")
 
     logging.info("Email contact extraction completed")
 
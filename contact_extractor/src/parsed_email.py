@@ -0,0 +1,100 @@
+import threading
+from simhash import simhash
+
+_UNSET = object()
+
+# Headers read by MLRecruiterFilter and NERContactExtractor
+PARSED_HEADERS = ("From", "Subject", "Sender", "Reply-To", "Message-ID")
+
+
+def _decode_payload(part):
+    payload = part.get_payload(decode=True)
+    if not payload:
+        return None
+    return payload.decode('utf-8', errors='ignore')
+
+
+class ParsedEmail:
+    """
+    A message decoded in a single MIME pass and shared by the filter and the
+    extractor: headers, the first text/plain and text/html bodies, every
+    text/calendar part, and a lazily memoised cleaned body and fingerprint.
+    HTML-only mail uses its text/html part as the body.
+    Wraps email.message.Message or PartialMessage.
+    """
+
+    def __init__(self, message):
+        self.message = message
+        self.headers = {name: message.get(name) for name in PARSED_HEADERS if name in message}
+        self.plain = None
+        self.html = None
+        self.calendars = []
+        self.has_calendar = False
+        self._clean_body = None
+        self._fingerprint = _UNSET
+        self._lock = threading.Lock()
+        self._parse()
+
+    def _parse(self):
+        message = self.message
+        if not message.is_multipart():
+            self.has_calendar = message.get_content_type() == "text/calendar"
+            # Single-part messages are read as-is, whatever their type
+            self.plain = _decode_payload(message) or ""
+            if message.get_content_type() == "text/html":
+                self.html = self.plain
+            return
+
+        for part in message.walk():
+            content_type = part.get_content_type()
+            if content_type == "text/plain":
+                if self.plain is None:
+                    self.plain = _decode_payload(part)
+            elif content_type == "text/html":
+                if self.html is None:
+                    self.html = _decode_payload(part)
+            elif content_type == "text/calendar":
+                self.has_calendar = True
+                calendar = _decode_payload(part)
+                if calendar:
+                    self.calendars.append(calendar)
+
+    @classmethod
+    def wrap(cls, message):
+        return message if isinstance(message, cls) else cls(message)
+
+    def get(self, name, failobj=None):
+        if name in self.headers:
+            return self.headers[name]
+        return self.message.get(name, failobj)
+
+    def __contains__(self, name):
+        return name in self.headers or name in self.message
+
+    @property
+    def body_is_html(self):
+        """True when body is HTML: a single text/html part, or text/html without a text/plain part."""
+        return bool(self.html) and (not self.plain or self.plain is self.html)
+
+    @property
+    def body(self):
+        """Raw body text: the text/plain part, else the text/html part."""
+        return self.plain or self.html or ""
+
+    def clean_body(self, cleaner):
+        """Cleaned body, computed once with `cleaner(body, is_html)` and memoised."""
+        if self._clean_body is None:
+            with self._lock:
+                if self._clean_body is None:
+                    self._clean_body = cleaner(self.body, self.body_is_html)
+        return self._clean_body
+
+    def fingerprint(self, cleaner):
+        """
+        SimHash of subject and cleaned body (None for very short mail),
+        computed once. Hashing the cleaned body keeps markup, quoted replies
+        and tracking links from separating copies of one template.
+        """
+        if self._fingerprint is _UNSET:
+            self._fingerprint = simhash(f"{self.get('Subject') or ''}\n{self.clean_body(cleaner)}")
+        return self._fingerprint
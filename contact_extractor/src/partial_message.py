@@ -0,0 +1,100 @@
+import base64
+import email
+import quopri
+
+
+class MessagePart:
+    """
+    A single MIME leaf part downloaded on its own with BODY.PEEK[n].
+    Mirrors the subset of email.message.Message used by the extractor.
+    """
+
+    def __init__(self, content_type, payload, encoding=None, charset=None, section=None):
+        self.content_type = content_type.lower()
+        self.payload = payload or b''
+        self.encoding = (encoding or '7bit').lower()
+        self.charset = charset
+        self.section = section
+
+    def get_content_type(self):
+        return self.content_type
+
+    def get_content_charset(self, failobj=None):
+        return self.charset or failobj
+
+    def is_multipart(self):
+        return False
+
+    def walk(self):
+        yield self
+
+    def get(self, name, failobj=None):
+        if name.lower() == 'content-type':
+            return self.content_type
+        if name.lower() == 'content-transfer-encoding':
+            return self.encoding
+        return failobj
+
+    def get_payload(self, decode=False):
+        if not decode:
+            return self.payload.decode('utf-8', errors='ignore')
+        try:
+            if self.encoding == 'base64':
+                return base64.b64decode(self.payload)
+            if self.encoding == 'quoted-printable':
+                return quopri.decodestring(self.payload)
+        except Exception:
+            return self.payload
+        return self.payload
+
+
+class PartialMessage:
+    """
+    Message assembled from the full header block plus the text parts picked
+    out of BODYSTRUCTURE. Attachments are never downloaded. Exposes the same
+    accessors the filter and extractor use on email.message.Message
+    (get, [], in, is_multipart, walk, get_content_type, get_payload).
+    """
+
+    def __init__(self, header_bytes, parts, multipart=True, content_type='multipart/mixed'):
+        self.headers = email.message_from_bytes(header_bytes or b'')
+        self.parts = parts
+        self.multipart = multipart
+        self.content_type = content_type.lower()
+
+    def get(self, name, failobj=None):
+        return self.headers.get(name, failobj)
+
+    def get_all(self, name, failobj=None):
+        return self.headers.get_all(name, failobj)
+
+    def items(self):
+        return self.headers.items()
+
+    def __getitem__(self, name):
+        return self.headers[name]
+
+    def __contains__(self, name):
+        return name in self.headers
+
+    def get_content_type(self):
+        return self.content_type
+
+    def is_multipart(self):
+        return self.multipart
+
+    def walk(self):
+        if not self.multipart and not self.parts:
+            yield self
+            return
+        if self.multipart:
+            yield self
+        for part in self.parts:
+            yield part
+
+    def get_payload(self, decode=False):
+        if self.multipart:
+            return self.parts
+        if self.parts:
+            return self.parts[0].get_payload(decode=decode)
+        return b'' if decode else ''
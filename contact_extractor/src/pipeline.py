@@ -0,0 +1,225 @@
+import email
+import logging
+import multiprocessing
+import os
+import queue
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from email_client import EmailClient, UIDWatermark
+from extractor import NERContactExtractor
+from filters import MLRecruiterFilter
+from main import (
+    IMAP_TIMEOUT_SECONDS, INITIAL_SYNC_DAYS, NER_BATCH_SIZE, RECRUITER_THRESHOLD,
+    analyse_batch, create_dedup_index, load_accounts
+)
+from storage import StorageManager
+
+# Stage parallelism and the number of batches allowed between fetch and store
+PIPELINE_FETCH_WORKERS = int(os.getenv('PIPELINE_FETCH_WORKERS', 8))
+PIPELINE_CPU_WORKERS = int(os.getenv('PIPELINE_CPU_WORKERS', os.cpu_count() or 1))
+PIPELINE_MAX_IN_FLIGHT = int(os.getenv('PIPELINE_MAX_IN_FLIGHT', 16))
+MODEL_DIR = "../models"
+
+_STOP = object()
+
+# Models of the current worker process, loaded once by _init_worker
+_worker = {}
+
+
+def _init_worker(model_dir, threshold, ner_batch_size):
+    _worker['email_filter'] = MLRecruiterFilter(model_dir=model_dir, threshold=threshold)
+    _worker['extractor'] = NERContactExtractor(batch_size=ner_batch_size, n_process=1)
+    # SQLite file shared with the other workers
+    _worker['dedup_index'] = create_dedup_index()
+
+
+def _to_payload(email_data):
+    """What a CPU worker needs from a fetched record; raw bytes pickle far cheaper than a Message tree."""
+    if email_data.get('raw') is not None:
+        return {'uid': email_data['uid'], 'raw': email_data['raw']}
+    return {'uid': email_data['uid'], 'message': email_data['message']}
+
+
+def _analyse_payloads(account, payloads):
+    """Parse, classify and extract one batch inside a CPU worker."""
+    emails = [
+        {'uid': payload['uid'], 'message': payload.get('message') or email.message_from_bytes(payload['raw'])}
+        for payload in payloads
+    ]
+    return analyse_batch(emails, account, _worker['extractor'], _worker['email_filter'], _worker['dedup_index'])
+
+
+class PipelineRunner:
+    """
+    Runs fetch -> parse/classify/extract -> store as concurrent stages, so
+    IMAP waits and model inference overlap instead of alternating.
+
+    - fetch: `fetch_workers` threads, one account at a time each.
+    - analyse: a process pool of `cpu_workers` processes, each loading the
+      classifier and spaCy model once (a single in-process thread when
+      cpu_workers is 0). Workers are spawned rather than forked: the pool
+      starts them on demand from fetch threads, and a fork from this
+      multi-threaded process can copy locks another thread holds.
+    - store: one writer thread that saves contacts and activity counts and
+      moves checkpoints.
+
+    At most `max_in_flight` batches exist between fetch and store; fetch
+    threads block until the store stage frees a slot. A batch only counts
+    as done once it has been stored, and each account's checkpoint is
+    moved with a UIDWatermark, so it never passes a UID whose batch is
+    still in flight or failed.
+    """
+
+    def __init__(self, storage, email_filter, fetch_workers=PIPELINE_FETCH_WORKERS,
+                 cpu_workers=PIPELINE_CPU_WORKERS, max_in_flight=PIPELINE_MAX_IN_FLIGHT,
+                 batch_size=100, model_dir=MODEL_DIR, threshold=RECRUITER_THRESHOLD,
+                 ner_batch_size=NER_BATCH_SIZE):
+        self.storage = storage
+        self.email_filter = email_filter
+        self.fetch_workers = max(1, fetch_workers)
+        self.cpu_workers = max(0, cpu_workers)
+        self.batch_size = batch_size
+        self.worker_args = (model_dir, threshold, ner_batch_size)
+        self.slots = threading.BoundedSemaphore(max(1, max_in_flight))
+        # Unbounded, but never holds more than max_in_flight batches
+        self.stored = queue.Queue()
+        self.results = {}
+        self._results_lock = threading.Lock()
+        self.logger = logging.getLogger(__name__)
+
+    def run(self, accounts):
+        """Process every account; returns {account email: contacts extracted or None}."""
+        if self.cpu_workers:
+            cpu_pool = ProcessPoolExecutor(
+                max_workers=self.cpu_workers, mp_context=multiprocessing.get_context('spawn'),
+                initializer=_init_worker, initargs=self.worker_args
+            )
+        else:
+            cpu_pool = ThreadPoolExecutor(max_workers=1, initializer=_init_worker, initargs=self.worker_args)
+
+        writer = threading.Thread(target=self._store_loop, name='pipeline-store')
+        writer.start()
+        try:
+            with ThreadPoolExecutor(max_workers=self.fetch_workers, thread_name_prefix='fetch') as fetch_pool:
+                for account in accounts:
+                    fetch_pool.submit(self._fetch_account, account, cpu_pool)
+        finally:
+            cpu_pool.shutdown(wait=True)
+            self.stored.put((_STOP, None, None))
+            writer.join()
+
+        failed = [account for account, extracted in self.results.items() if extracted is None]
+        self.logger.info(
+            f"Pipeline processed {len(self.results)} accounts: {len(failed)} failed, "
+            f"{sum(extracted or 0 for extracted in self.results.values())} contacts extracted"
+        )
+        return dict(self.results)
+
+    def _fetch_account(self, account, cpu_pool):
+        account_email = account['email']
+        email_client = EmailClient(
+            account,
+            sender_filter=self.email_filter.is_junk_email,
+            timeout=IMAP_TIMEOUT_SECONDS,
+            server_rules=self.email_filter.sender_rules,
+            initial_sync_days=INITIAL_SYNC_DAYS
+        )
+        if not email_client.connect():
+            self.logger.error(f"Failed to connect to {account_email}")
+            self._set_result(account_email, None)
+            return
+
+        try:
+            last_uid = self.storage.resolve_last_uid(account_email, email_client.uid_validity)
+            cursor = email_client.snapshot_uids(last_uid)
+            self._set_result(account_email, 0)
+            if cursor is None or cursor.exhausted:
+                return
+            state = {
+                'account': account,
+                'watermark': UIDWatermark(cursor.uids, start_uid=last_uid),
+                'uid_validity': email_client.uid_validity
+            }
+
+            while cursor:
+                batch_uids = cursor.peek(self.batch_size)
+                emails, cursor = email_client.fetch_emails(
+                    since_uid=last_uid, batch_size=self.batch_size, cursor=cursor
+                )
+                if not emails:
+                    break
+                # Failed UIDs are never marked done, so the checkpoint stays below them
+                failed = email_client.take_failed_uids()
+                batch_uids = [uid for uid in batch_uids if str(uid) not in failed]
+                payloads = [_to_payload(email_data) for email_data in emails if not email_data.get('prefiltered')]
+                self.slots.acquire()
+                try:
+                    future = cpu_pool.submit(_analyse_payloads, {'email': account_email}, payloads)
+                except Exception:
+                    self.slots.release()
+                    raise
+                future.add_done_callback(
+                    lambda done, uids=batch_uids: self.stored.put((state, uids, done))
+                )
+        except Exception as e:
+            self.logger.error(f"Error fetching account {account_email}: {e}")
+            self._set_result(account_email, None)
+        finally:
+            email_client.disconnect()
+
+    def _store_loop(self):
+        while True:
+            state, batch_uids, future = self.stored.get()
+            if state is _STOP:
+                return
+            try:
+                self._store(state, batch_uids, future)
+            except Exception as e:
+                self.logger.error(f"Error storing batch for {state['account']['email']}: {e}")
+            finally:
+                self.slots.release()
+
+    def _store(self, state, batch_uids, future):
+        account_email = state['account']['email']
+        try:
+            contacts, recruiter_count = future.result()
+        except Exception as e:
+            # The batch is not marked done, so the checkpoint stays below it
+            self.logger.error(f"Analysis failed for {account_email} ({len(batch_uids)} messages): {e}")
+            return
+
+        if contacts:
+            self.storage.save_contacts(account_email, contacts)
+        self.storage.log_email_activity(account_email, recruiter_count)
+        with self._results_lock:
+            if self.results.get(account_email) is not None:
+                self.results[account_email] += len(contacts)
+
+        watermark = state['watermark']
+        if watermark.mark_done(batch_uids):
+            self.storage.save_last_run(account_email, str(watermark.value), state['uid_validity'])
+
+    def _set_result(self, account_email, value):
+        with self._results_lock:
+            self.results[account_email] = value
+
+
+def main():
+    logging.info(" Starting pipelined email contact extraction...")
+    accounts = load_accounts(filter_tags=["job_search"])
+    if not accounts:
+        logging.error("No active accounts found")
+        return
+
+    # The store stage is already the single writer, so storage writes inline
+    storage = StorageManager()
+    email_filter = MLRecruiterFilter(model_dir=MODEL_DIR, threshold=RECRUITER_THRESHOLD)
+    try:
+        PipelineRunner(storage, email_filter).run(accounts)
+    finally:
+        storage.close()
+    logging.info("Email contact extraction completed")
+
+
+if __name__ == "__main__":
+    main()
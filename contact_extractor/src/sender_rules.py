@@ -0,0 +1,134 @@
+import hashlib
+import json
+import re
+import threading
+from collections import OrderedDict
+
+_ADDRESS_PATTERN = re.compile(r"[^@]+@[^@]+\.[^@]+")
+# A complete address, usable as an exact server-side FROM term
+_EXACT_ADDRESS = re.compile(r"[a-z0-9_.+-]+@[a-z0-9-]+(?:\.[a-z0-9-]+)+")
+_EXACT_DOMAIN = re.compile(r"[a-z0-9-]+(?:\.[a-z0-9-]+)+")
+
+
+def _alternation(terms):
+    """One compiled regex matching any of `terms` as a substring, or None."""
+    terms = sorted({term for term in terms if term}, key=len, reverse=True)
+    if not terms:
+        return None
+    return re.compile("|".join(re.escape(term) for term in terms))
+
+
+class SenderRules:
+    """
+    Compiled form of the sender blacklists used by MLRecruiterFilter.
+
+    Keywords and blacklist entries are matched with a single alternation
+    regex each instead of a Python loop per rule, domains with set lookups,
+    and verdicts are memoised in a bounded LRU keyed by the normalised
+    address, since the same senders repeat across mailboxes.
+    """
+
+    def __init__(self, blacklist_keywords, personal_domains, service_domains,
+                 exact_email_blacklist, junk_pattern, cache_size=10000):
+        self.personal_domains = frozenset(personal_domains)
+        self.service_domains = frozenset(service_domains)
+        self.ignored_domains = self.personal_domains | self.service_domains
+        self.exact_email_blacklist = frozenset(exact_email_blacklist)
+        self.keyword_matcher = _alternation(blacklist_keywords)
+        # Blacklist entries also match as substrings of the address
+        self.blacklist_matcher = _alternation(exact_email_blacklist)
+        self.junk_pattern = junk_pattern
+        self.version = self._fingerprint(
+            blacklist_keywords, personal_domains, service_domains,
+            exact_email_blacklist, junk_pattern.pattern
+        )
+
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _fingerprint(*rule_sets):
+        payload = json.dumps(
+            [sorted(rules) if not isinstance(rules, str) else rules for rules in rule_sets]
+        )
+        return hashlib.sha1(payload.encode("utf-8")).hexdigest()[:12]
+
+    def _evaluate(self, email):
+        """Returns (should_ignore, is_junk) for a normalised address."""
+        if not _ADDRESS_PATTERN.match(email):
+            return True, True
+
+        if email in self.exact_email_blacklist:
+            return True, True
+
+        local_part, domain = email.split("@", 1)
+
+        ignore = (
+            self.has_blacklisted_keyword(local_part)
+            or domain in self.ignored_domains
+            or (self.blacklist_matcher is not None and self.blacklist_matcher.search(email) is not None)
+        )
+        if ignore:
+            return True, True
+
+        junk = domain in self.service_domains or self.junk_pattern.match(email) is not None
+        return False, junk
+
+    def verdict(self, email):
+        key = email.lower().strip()
+        with self._lock:
+            cached = self._cache.get(key)
+            if cached is not None:
+                self._cache.move_to_end(key)
+                self.hits += 1
+                return cached
+            self.misses += 1
+
+        result = self._evaluate(key)
+        with self._lock:
+            self._cache[key] = result
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return result
+
+    def server_search_terms(self):
+        """
+        FROM substrings whose mail the client-side rules reject anyway, for
+        use as IMAP "NOT FROM" criteria: "<address>" for each complete
+        address of the exact blacklist and "@domain>" for each service
+        domain. The angle brackets anchor a term to the address part of
+        "Name <user@host>", so it matches neither a longer address nor the
+        display name; keywords are left out as they cannot be anchored.
+        Calendar invites from these senders are still kept by the client
+        (see EmailClient.snapshot_uids).
+        """
+        addresses = {entry.lower().strip() for entry in self.exact_email_blacklist}
+        terms = {f"<{address}>" for address in addresses if _EXACT_ADDRESS.fullmatch(address)}
+        terms.update(
+            f"@{domain}>" for domain in {domain.lower().strip() for domain in self.service_domains}
+            if _EXACT_DOMAIN.fullmatch(domain)
+        )
+        return sorted(terms)
+
+    def has_blacklisted_keyword(self, local_part):
+        return self.keyword_matcher is not None and self.keyword_matcher.search(local_part) is not None
+
+    def should_ignore(self, email):
+        return self.verdict(email)[0]
+
+    def is_junk(self, email):
+        return self.verdict(email)[1]
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+                "size": len(self._cache),
+            }
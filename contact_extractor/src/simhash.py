@@ -0,0 +1,116 @@
+import hashlib
+import re
+import threading
+from collections import OrderedDict
+
+FINGERPRINT_BITS = 64
+# Shorter texts give unstable fingerprints and are never matched
+MIN_SHINGLES = 8
+# Only the start of long bodies is fingerprinted
+MAX_FINGERPRINT_CHARS = 10000
+
+# Words only: digits (job IDs, dates, rates) vary between copies of a template
+_WORD = re.compile(r"[a-z]{2,}")
+
+
+def simhash(text, shingle_size=3):
+    """
+    64-bit SimHash of the word shingles of `text`, or None when the text is
+    too short. Texts that differ in a few words (a greeting name, a job ID)
+    get fingerprints a small Hamming distance apart.
+    """
+    words = _WORD.findall(text[:MAX_FINGERPRINT_CHARS].lower())
+    shingles = {" ".join(words[i:i + shingle_size]) for i in range(max(0, len(words) - shingle_size + 1))}
+    if len(shingles) < MIN_SHINGLES:
+        return None
+    bit_strings = [
+        format(int.from_bytes(hashlib.blake2b(shingle.encode(), digest_size=8).digest(), "big"), "064b")
+        for shingle in shingles
+    ]
+    # Column-wise bit counts in one pass; bit i is set when most shingles set it
+    half = len(bit_strings) / 2
+    fingerprint = 0
+    for column in zip(*bit_strings):
+        fingerprint = (fingerprint << 1) | (column.count("1") > half)
+    return fingerprint
+
+
+def hamming(a, b):
+    return bin(a ^ b).count("1")
+
+
+class SimHashIndex:
+    """
+    Bounded LRU of fingerprint -> payload with near-duplicate lookup.
+
+    Fingerprints are split into max_distance + 1 bands; two fingerprints
+    within max_distance bits of each other agree exactly on at least one
+    band, so a lookup only compares against entries sharing a band.
+    """
+
+    def __init__(self, max_entries=5000, max_distance=7):
+        self.max_entries = max_entries
+        self.max_distance = max_distance
+        self.band_count = max_distance + 1
+        self.band_width = -(-FINGERPRINT_BITS // self.band_count)
+        self._entries = OrderedDict()
+        self._bands = [{} for _ in range(self.band_count)]
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _band_keys(self, fingerprint):
+        mask = (1 << self.band_width) - 1
+        return [(fingerprint >> (i * self.band_width)) & mask for i in range(self.band_count)]
+
+    def get(self, fingerprint, match=None):
+        """
+        Payload of the closest entry within max_distance, or None.
+        match: predicate on payloads; entries it rejects are never returned,
+        and a lookup that only finds such entries counts as a miss.
+        """
+        if fingerprint is None:
+            return None
+        with self._lock:
+            candidates = set()
+            for band, key in zip(self._bands, self._band_keys(fingerprint)):
+                candidates.update(band.get(key, ()))
+            best, best_distance = None, self.max_distance + 1
+            for candidate in candidates:
+                distance = hamming(candidate, fingerprint)
+                if distance < best_distance and (match is None or match(self._entries[candidate])):
+                    best, best_distance = candidate, distance
+            if best is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(best)
+            self.hits += 1
+            return self._entries[best]
+
+    def put(self, fingerprint, payload):
+        if fingerprint is None or not self.max_entries:
+            return
+        with self._lock:
+            if fingerprint not in self._entries:
+                for band, key in zip(self._bands, self._band_keys(fingerprint)):
+                    band.setdefault(key, set()).add(fingerprint)
+            self._entries[fingerprint] = payload
+            self._entries.move_to_end(fingerprint)
+            while len(self._entries) > self.max_entries:
+                evicted, _ = self._entries.popitem(last=False)
+                for band, key in zip(self._bands, self._band_keys(evicted)):
+                    members = band.get(key)
+                    if members is not None:
+                        members.discard(evicted)
+                        if not members:
+                            del band[key]
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+                "size": len(self._entries),
+            }
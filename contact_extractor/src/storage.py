@@ -1,135 +1,196 @@
 import logging
 import os
-import json
-from datetime import datetime
-import mysql.connector
 from dotenv import load_dotenv
+from checkpoints import CheckpointStore
+from storage_backends import create_backend
 
 load_dotenv()
 
+# Max values per IN (...) list when looking up existing contacts
+LOOKUP_CHUNK_SIZE = 500
+
 class StorageManager:
-    def __init__(self):
+    def __init__(self, backend=None):
         self.logger = logging.getLogger(__name__)
         base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
         self.data_dir = os.path.join(base_dir, 'data')
         self.last_run_path = os.path.join(self.data_dir, 'last_run.json')
         os.makedirs(self.data_dir, exist_ok=True)
+        self.checkpoints = CheckpointStore(
+            os.path.join(self.data_dir, 'checkpoints.db'), legacy_json_path=self.last_run_path
+        )
 
-        self.db_config = {
-            'host': os.getenv('DB_HOST', 'localhost'),
-            'user': os.getenv('DB_USER', 'root'),
-            'password': os.getenv('DB_PASSWORD', ''),
-            'database': os.getenv('DB_NAME', 'your_database')
-        }
+        # Pooled MySQL by default, or SQLite with STORAGE_BACKEND=sqlite
+        self.backend = backend or create_backend()
 
     def save_contacts(self, email_account: str, contacts: list):
+        """Upsert a batch of contacts, logging instead of raising on failure."""
         if not contacts:
             self.logger.info(f"No contacts to save for {email_account}")
             return
 
         try:
-            conn = mysql.connector.connect(**self.db_config)
-            cursor = conn.cursor(dictionary=True)
-            new_count = 0
-
-            for contact in contacts:
-                email = contact.get('email')
-                linkedin = contact.get('linkedin_id')
-                name = contact.get('name', '')
-                phone = contact.get('phone', '')
-                company = contact.get('company', '')
-                location = contact.get('location', '')
-                source = contact.get('source', email_account).lower()
-
-                if email:
-                    cursor.execute("SELECT * FROM vendor_contact_extracts WHERE email = %s", (email,))
-                    row = cursor.fetchone()
-                    if row:
-                        if not row["linkedin_id"] and linkedin:
-                            cursor.execute("""
-                                UPDATE vendor_contact_extracts
-                                SET linkedin_id=%s, full_name=%s, phone=%s,
-                                    company_name=%s, location=%s, source_email=%s
-                                WHERE id=%s
-                            """, (linkedin, name, phone, company, location, source, row["id"]))
-                            conn.commit()
-                        continue
-
-                if linkedin:
-                    cursor.execute("SELECT * FROM vendor_contact_extracts WHERE linkedin_id = %s", (linkedin,))
-                    row = cursor.fetchone()
-                    if row:
-                        if not row["email"] and email:
-                            cursor.execute("""
-                                UPDATE vendor_contact_extracts
-                                SET email=%s, full_name=%s, phone=%s,
-                                    company_name=%s, location=%s, source_email=%s
-                                WHERE id=%s
-                            """, (email, name, phone, company, location, source, row["id"]))
-                            conn.commit()
-                        continue
-
-                cursor.execute("""
-                    INSERT INTO vendor_contact_extracts
-                    (full_name, source_email, email, phone, linkedin_id, company_name, location, extraction_date, moved_to_vendor, created_at)
-                    VALUES (%s,%s,%s,%s,%s,%s,%s,CURDATE(),0,NOW())
-                """, (name, source, email, phone, linkedin, company, location))
-                conn.commit()
-                new_count += 1
-
-            cursor.close()
-            conn.close()
-            self.logger.info(f"Inserted {new_count} new contacts into database.")
-
-        except mysql.connector.Error as err:
-            self.logger.error(f"MySQL error: {err}")
+            inserted, updated = self.upsert_contacts(email_account, contacts)
+            self.logger.info(f"Inserted {inserted} new contacts into database ({updated} updated).")
         except Exception as e:
-            self.logger.error(f"Unexpected error saving contacts: {str(e)}")
+            self.logger.error(f"Error saving contacts: {str(e)}")
+
+    def upsert_contacts(self, email_account: str, contacts: list):
+        """
+        Upsert a batch of contacts in one transaction: one lookup for the
+        existing rows, then executemany for updates and inserts.
+        An existing row matched by email only gains a linkedin_id it lacks,
+        and one matched by linkedin_id only gains an email it lacks; contacts
+        matching neither are inserted. Contacts are applied in order, so a
+        later contact can fill in a row inserted earlier in the same batch.
+        Returns (inserted, updated); database errors propagate.
+        """
+        with self.backend.transaction() as cursor:
+            emails = {c['email'] for c in contacts if c.get('email')}
+            linkedins = {c['linkedin_id'] for c in contacts if c.get('linkedin_id')}
+            existing = self._fetch_existing_contacts(cursor, emails, linkedins)
+            updates, inserts = self._merge_contacts(email_account, contacts, existing)
+
+            if updates:
+                cursor.executemany(self.backend.update_contact_sql, [
+                    (row['email'], row['linkedin_id'], row['full_name'], row['phone'],
+                     row['company_name'], row['location'], row['source_email'], row['id'])
+                    for row in updates
+                ])
+            if inserts:
+                cursor.executemany(self.backend.insert_contact_sql, [
+                    (row['full_name'], row['source_email'], row['email'], row['phone'],
+                     row['linkedin_id'], row['company_name'], row['location'])
+                    for row in inserts
+                ])
+        return len(inserts), len(updates)
+
+    def _fetch_existing_contacts(self, cursor, emails, linkedins):
+        """Existing rows matching any of the emails or LinkedIn IDs, in chunked IN queries."""
+        rows = {}
+        placeholder = self.backend.placeholder
+        emails, linkedins = list(emails), list(linkedins)
+        for i in range(0, max(len(emails), len(linkedins)), LOOKUP_CHUNK_SIZE):
+            email_chunk = emails[i:i + LOOKUP_CHUNK_SIZE]
+            linkedin_chunk = linkedins[i:i + LOOKUP_CHUNK_SIZE]
+            clauses, params = [], []
+            if email_chunk:
+                clauses.append(f"email IN ({', '.join([placeholder] * len(email_chunk))})")
+                params.extend(email_chunk)
+            if linkedin_chunk:
+                clauses.append(f"linkedin_id IN ({', '.join([placeholder] * len(linkedin_chunk))})")
+                params.extend(linkedin_chunk)
+            cursor.execute(f"""
+                SELECT id, email, linkedin_id, full_name, phone, company_name, location, source_email
+                FROM vendor_contact_extracts
+                WHERE {' OR '.join(clauses)}
+                ORDER BY id
+            """, params)
+            for row in cursor.fetchall():
+                rows[row['id']] = row
+        return list(rows.values())
+
+    @staticmethod
+    def _merge_contacts(email_account, contacts, existing):
+        """
+        Apply the per-contact merge rules in memory.
+        Returns (rows to update, rows to insert).
+        """
+        by_email, by_linkedin = {}, {}
+
+        def first(current, row):
+            # Mirror "SELECT ... LIMIT 1" in id order; pending inserts sort last
+            if current is None:
+                return row
+            if row['id'] is not None and (current['id'] is None or row['id'] < current['id']):
+                return row
+            return current
+
+        def index(row):
+            if row['email']:
+                key = row['email'].lower()
+                by_email[key] = first(by_email.get(key), row)
+            if row['linkedin_id']:
+                key = row['linkedin_id'].lower()
+                by_linkedin[key] = first(by_linkedin.get(key), row)
+
+        for row in existing:
+            index(row)
+
+        updated, inserts = {}, []
+        for contact in contacts:
+            email = contact.get('email')
+            linkedin = contact.get('linkedin_id')
+            fields = {
+                'full_name': contact.get('name', ''),
+                'phone': contact.get('phone', ''),
+                'company_name': contact.get('company', ''),
+                'location': contact.get('location', ''),
+                'source_email': contact.get('source', email_account).lower(),
+            }
+
+            if email:
+                row = by_email.get(email.lower())
+                if row:
+                    if not row['linkedin_id'] and linkedin:
+                        row.update(fields, linkedin_id=linkedin)
+                        index(row)
+                        if row['id'] is not None:
+                            updated[row['id']] = row
+                    continue
+
+            if linkedin:
+                row = by_linkedin.get(linkedin.lower())
+                if row:
+                    if not row['email'] and email:
+                        row.update(fields, email=email)
+                        index(row)
+                        if row['id'] is not None:
+                            updated[row['id']] = row
+                    continue
+
+            # Rows pending insert have no id yet; later contacts update them in place
+            row = dict(fields, id=None, email=email, linkedin_id=linkedin)
+            inserts.append(row)
+            index(row)
+
+        return list(updated.values()), inserts
 
-    
     def log_email_activity(self, candidate_email, emails_count):
         """
         Logs the number of emails processed for a candidate.
         Inserts new row if doesn't exist, increments emails_read if exists.
         """
         try:
-            conn = mysql.connector.connect(**self.db_config)
-            cursor = conn.cursor()
-            cursor.execute("""
-                INSERT INTO email_activity_log (candidate_marketing_id, email, emails_read, activity_date)
-                SELECT id, %s, %s, CURDATE()
-                FROM candidate_marketing
-                WHERE email=%s
-                ON DUPLICATE KEY UPDATE
-                    emails_read = emails_read + VALUES(emails_read),
-                    last_updated = CURRENT_TIMESTAMP
-            """, (candidate_email, emails_count, candidate_email))
-            conn.commit()
-            cursor.close()
-            conn.close()
+            self.record_email_activity(candidate_email, emails_count)
             self.logger.info(f"Logged {emails_count} emails for {candidate_email} in email_activity_log")
         except Exception as e:
             self.logger.error(f"Failed to log email activity: {e}")
+
+    def record_email_activity(self, candidate_email, emails_count):
+        """log_email_activity without the error handling; database errors propagate."""
+        self.backend.log_email_activity(candidate_email, emails_count)
+
+    def close(self):
+        self.backend.close()
     
     def load_last_run(self):
         try:
-            if os.path.exists(self.last_run_path):
-                with open(self.last_run_path, 'r') as f:
-                    return json.load(f)
-            return {}
+            return self.checkpoints.load_all()
         except Exception as e:
             self.logger.error(f"Error loading last run data: {str(e)}")
             return {}
 
-    def save_last_run(self, email_account: str, last_uid: str):
+    def resolve_last_uid(self, email_account: str, uid_validity=None):
+        """Checkpoint UID to resume from, or None after a UIDVALIDITY change; see CheckpointStore.resolve."""
         try:
-            data = self.load_last_run()
-            data[email_account] = {
-                'last_uid': last_uid,
-                'last_run': datetime.now().isoformat()
-            }
+            return self.checkpoints.resolve(email_account, uid_validity)
+        except Exception as e:
+            self.logger.error(f"Error loading last run data: {str(e)}")
+            return None
 
-            with open(self.last_run_path, 'w') as f:
-                json.dump(data, f, indent=2)
+    def save_last_run(self, email_account: str, last_uid: str, uid_validity=None):
+        try:
+            self.checkpoints.save(email_account, last_uid, uid_validity)
         except Exception as e:
-            self.logger.error(f"Error saving last run data: {str(e)}")
\ No newline at end of file
+            self.logger.error(f"Error saving last run data: {str(e)}")
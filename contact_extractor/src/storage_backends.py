@@ -0,0 +1,297 @@
+import logging
+import os
+from abc import ABC, abstractmethod
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from dotenv import load_dotenv
+
+load_dotenv()
+
+DEFAULT_POOL_SIZE = 5
+POOL_WAIT_SECONDS = 30
+# Attempts to open the pool, or to get a healthy connection, on one checkout
+POOL_CONNECT_ATTEMPTS = 3
+POOL_CONNECT_RETRY_SECONDS = 1
+
+
+class StorageBackend(ABC):
+    """
+    Database access used by StorageManager. A backend owns its connections
+    and knows its SQL dialect; the merge logic stays in StorageManager.
+
+    transaction() yields a cursor whose rows are dicts, commits when the
+    block succeeds and rolls back when it raises.
+    """
+
+    # DB-API parameter placeholder
+    placeholder = '%s'
+    update_contact_sql = None
+    insert_contact_sql = None
+
+    @abstractmethod
+    def transaction(self):
+        """Context manager yielding a dict-row cursor inside one transaction."""
+
+    @abstractmethod
+    def log_email_activity(self, candidate_email, emails_count):
+        """Add emails_count to today's activity row for the candidate."""
+
+    def close(self):
+        pass
+
+
+class MySQLBackend(StorageBackend):
+    """
+    MySQL backend with a bounded connection pool. The pool is opened on
+    the first checkout rather than in the constructor, so the backend can
+    be created while the server is down; a checkout that cannot open it
+    retries a few times and then raises. Connections are health-checked
+    (ping with reconnect) when they are checked out; an unhealthy one is
+    discarded and the checkout retried after a growing delay, a few times
+    at most. Callers wait for a free connection instead of opening new ones.
+    """
+
+    update_contact_sql = """
+        UPDATE vendor_contact_extracts
+        SET email=%s, linkedin_id=%s, full_name=%s, phone=%s,
+            company_name=%s, location=%s, source_email=%s
+        WHERE id=%s
+    """
+    insert_contact_sql = """
+        INSERT INTO vendor_contact_extracts
+        (full_name, source_email, email, phone, linkedin_id, company_name, location, extraction_date, moved_to_vendor, created_at)
+        VALUES (%s,%s,%s,%s,%s,%s,%s,CURDATE(),0,NOW())
+    """
+
+    def __init__(self, db_config=None, pool_size=None, pool_name='contact_extractor'):
+        import mysql.connector.pooling
+
+        self.logger = logging.getLogger(__name__)
+        self.db_config = db_config or {
+            'host': os.getenv('DB_HOST', 'localhost'),
+            'user': os.getenv('DB_USER', 'root'),
+            'password': os.getenv('DB_PASSWORD', ''),
+            'database': os.getenv('DB_NAME', 'your_database'),
+            'port': int(os.getenv('DB_PORT', 3306))
+        }
+        self.pool_size = pool_size or int(os.getenv('DB_POOL_SIZE', DEFAULT_POOL_SIZE))
+        self.pool_name = pool_name
+        self._pooling = mysql.connector.pooling
+        self._errors = mysql.connector.Error
+        self._pool_errors = mysql.connector.errors.PoolError
+        self.pool = None
+        self._pool_lock = threading.Lock()
+
+    def _get_pool(self):
+        """Open the pool on first use; retried on later checkouts if the server is unreachable."""
+        with self._pool_lock:
+            if self.pool is not None:
+                return self.pool
+            for attempt in range(1, POOL_CONNECT_ATTEMPTS + 1):
+                try:
+                    self.pool = self._pooling.MySQLConnectionPool(
+                        pool_name=self.pool_name,
+                        pool_size=self.pool_size,
+                        pool_reset_session=True,
+                        **self.db_config
+                    )
+                    return self.pool
+                except self._errors as err:
+                    if attempt == POOL_CONNECT_ATTEMPTS:
+                        raise
+                    self.logger.warning(f"Could not open MySQL pool (attempt {attempt}): {err}")
+                    time.sleep(POOL_CONNECT_RETRY_SECONDS * attempt)
+
+    def get_connection(self):
+        """Check out a healthy pooled connection; close() returns it to the pool."""
+        self._get_pool()
+        deadline = time.monotonic() + POOL_WAIT_SECONDS
+        unhealthy = 0
+        while True:
+            try:
+                conn = self.pool.get_connection()
+            except self._pool_errors:
+                if time.monotonic() >= deadline:
+                    raise
+                time.sleep(0.05)
+                continue
+            try:
+                conn.ping(reconnect=True, attempts=2, delay=0)
+                return conn
+            except self._errors as err:
+                self.logger.warning(f"Discarding unhealthy MySQL connection: {err}")
+                conn.close()
+                unhealthy += 1
+                if unhealthy >= POOL_CONNECT_ATTEMPTS or time.monotonic() >= deadline:
+                    raise
+                time.sleep(POOL_CONNECT_RETRY_SECONDS * unhealthy)
+
+    @contextmanager
+    def transaction(self):
+        conn = self.get_connection()
+        cursor = conn.cursor(dictionary=True)
+        try:
+            yield cursor
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            cursor.close()
+            conn.close()
+
+    def log_email_activity(self, candidate_email, emails_count):
+        with self.transaction() as cursor:
+            cursor.execute("""
+                INSERT INTO email_activity_log (candidate_marketing_id, email, emails_read, activity_date)
+                SELECT id, %s, %s, CURDATE()
+                FROM candidate_marketing
+                WHERE email=%s
+                ON DUPLICATE KEY UPDATE
+                    emails_read = emails_read + VALUES(emails_read),
+                    last_updated = CURRENT_TIMESTAMP
+            """, (candidate_email, emails_count, candidate_email))
+
+
+class SQLiteBackend(StorageBackend):
+    """
+    Embedded SQLite backend (WAL mode) with the same vendor_contact_extracts
+    and email_activity_log schema, for local runs, backfills and benchmarks
+    without a database server. One connection per thread.
+    """
+
+    placeholder = '?'
+    update_contact_sql = """
+        UPDATE vendor_contact_extracts
+        SET email=?, linkedin_id=?, full_name=?, phone=?,
+            company_name=?, location=?, source_email=?
+        WHERE id=?
+    """
+    insert_contact_sql = """
+        INSERT INTO vendor_contact_extracts
+        (full_name, source_email, email, phone, linkedin_id, company_name, location, extraction_date, moved_to_vendor, created_at)
+        VALUES (?,?,?,?,?,?,?,date('now'),0,datetime('now'))
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS vendor_contact_extracts (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            full_name TEXT,
+            source_email TEXT,
+            email TEXT COLLATE NOCASE,
+            phone TEXT,
+            linkedin_id TEXT COLLATE NOCASE,
+            company_name TEXT,
+            location TEXT,
+            extraction_date TEXT,
+            moved_to_vendor INTEGER DEFAULT 0,
+            created_at TEXT
+        );
+        CREATE INDEX IF NOT EXISTS idx_vendor_contact_email ON vendor_contact_extracts (email);
+        CREATE INDEX IF NOT EXISTS idx_vendor_contact_linkedin ON vendor_contact_extracts (linkedin_id);
+        CREATE TABLE IF NOT EXISTS candidate_marketing (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            email TEXT UNIQUE COLLATE NOCASE
+        );
+        CREATE TABLE IF NOT EXISTS email_activity_log (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            candidate_marketing_id INTEGER NOT NULL,
+            email TEXT,
+            emails_read INTEGER DEFAULT 0,
+            activity_date TEXT,
+            last_updated TEXT DEFAULT CURRENT_TIMESTAMP,
+            UNIQUE (candidate_marketing_id, activity_date)
+        );
+    """
+
+    def __init__(self, path=None):
+        self.logger = logging.getLogger(__name__)
+        if path is None:
+            base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+            path = os.getenv('SQLITE_PATH', os.path.join(base_dir, 'data', 'contacts.db'))
+        if path != ':memory:':
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.path = path
+        self._local = threading.local()
+        self._connections = []
+        self._connections_lock = threading.Lock()
+        self.get_connection().executescript(self.SCHEMA)
+
+    def get_connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            # Transactions are opened explicitly in transaction()
+            conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            with self._connections_lock:
+                self._connections.append(conn)
+        return conn
+
+    @contextmanager
+    def transaction(self):
+        conn = self.get_connection()
+        cursor = _DictCursor(conn.cursor())
+        # Take the write lock up front so the lookup and the writes that
+        # depend on it are atomic and never fail on a lock upgrade
+        cursor.execute("BEGIN IMMEDIATE")
+        try:
+            yield cursor
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            cursor.close()
+
+    def log_email_activity(self, candidate_email, emails_count):
+        with self.transaction() as cursor:
+            # Local databases have no candidate roster; register on first use
+            cursor.execute("INSERT OR IGNORE INTO candidate_marketing (email) VALUES (?)", (candidate_email,))
+            cursor.execute("""
+                INSERT INTO email_activity_log (candidate_marketing_id, email, emails_read, activity_date)
+                SELECT id, ?, ?, date('now')
+                FROM candidate_marketing
+                WHERE email=?
+                ON CONFLICT (candidate_marketing_id, activity_date) DO UPDATE SET
+                    emails_read = emails_read + excluded.emails_read,
+                    last_updated = CURRENT_TIMESTAMP
+            """, (candidate_email, emails_count, candidate_email))
+
+    def close(self):
+        with self._connections_lock:
+            for conn in self._connections:
+                conn.close()
+            self._connections = []
+        self._local = threading.local()
+
+
+class _DictCursor:
+    """sqlite3 cursor wrapper returning dict rows like MySQL's dictionary cursor."""
+
+    def __init__(self, cursor):
+        self._cursor = cursor
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    def fetchone(self):
+        row = self._cursor.fetchone()
+        return dict(row) if row is not None else None
+
+    def fetchall(self):
+        return [dict(row) for row in self._cursor.fetchall()]
+
+
+def create_backend(kind=None):
+    """Backend from STORAGE_BACKEND (mysql or sqlite); defaults to mysql."""
+    kind = (kind or os.getenv('STORAGE_BACKEND', 'mysql')).lower()
+    if kind == 'sqlite':
+        return SQLiteBackend()
+    if kind == 'mysql':
+        return MySQLBackend()
+    raise ValueError(f"Unknown storage backend: {kind}")
@@ -1,17 +1,186 @@
-import pandas as pd
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.linear_model import LogisticRegression
+import argparse
+import logging
+import json
+import os
+import time
 import joblib
+import numpy as np
+import pandas as pd
+from sklearn.feature_extraction.text import HashingVectorizer, TfidfVectorizer
+from sklearn.linear_model import LogisticRegression, SGDClassifier
+from filters import INFERENCE_DIR, INFERENCE_META, vocabulary_hash
+
+DATA_PATH = "../data/labeled_emails.csv"
+MODEL_DIR = "../models"
+# Hashed mode: rows per chunk read from the CSV, and feature space size
+CHUNK_SIZE = 10000
+HASH_FEATURES = 2 ** 20
+CLASSES = [0, 1]
+
+
+def _texts(df):
+    # Same layout MLRecruiterFilter.classify_batch scores: subject, body, sender
+    return df['subject'].fillna('') + " " + df['body'].fillna('') + " " + df['from_email'].fillna('')
+
+
+def _save(model_dir, classifier, vectorizer):
+    """Write both artifacts next to the live ones, then swap them in, and export the NumPy artifact."""
+    os.makedirs(model_dir, exist_ok=True)
+    for name, obj in (("classifier.pkl", classifier), ("vectorizer.pkl", vectorizer)):
+        path = os.path.join(model_dir, name)
+        joblib.dump(obj, path + ".tmp")
+        os.replace(path + ".tmp", path)
+    export_inference(model_dir, classifier, vectorizer)
+
+
+def export_inference(model_dir, classifier, vectorizer):
+    """
+    Write the model as the NumPy-only artifact filters.LinearTextModel
+    loads: weights (oriented towards label 1), the IDF array and a sorted
+    term-hash vocabulary for TF-IDF models, plus a meta.json manifest.
+    Array files carry a version suffix and meta.json is replaced last,
+    so a process loading the artifact never mixes two exports.
+    """
+    if getattr(vectorizer, 'analyzer', None) != 'word' or vectorizer.tokenizer or vectorizer.preprocessor \
+            or vectorizer.stop_words or vectorizer.strip_accents or vectorizer.binary or vectorizer.norm != 'l2':
+        raise ValueError("Only word analyzers with default tokenisation and l2 norm can be exported")
+    classes = list(classifier.classes_)
+    if sorted(classes) != CLASSES:
+        raise ValueError(f"Expected a binary classifier over {CLASSES}, got {classes}")
+    sign = 1.0 if classes.index(1) == 1 else -1.0
+    weights = sign * np.asarray(classifier.coef_, dtype=np.float64).ravel()
+
+    arrays = {'weights': weights.astype(np.float32)}
+    if isinstance(vectorizer, HashingVectorizer):
+        if vectorizer.alternate_sign:
+            raise ValueError("Hashed models must use alternate_sign=False to be exported")
+        kind, n_features = 'hashed', vectorizer.n_features
+    else:
+        if vectorizer.sublinear_tf:
+            raise ValueError("Sublinear TF models cannot be exported")
+        kind, n_features = 'tfidf', len(vectorizer.vocabulary_)
+        terms = list(vectorizer.vocabulary_)
+        hashes = np.array([vocabulary_hash(term) for term in terms], dtype=np.uint64)
+        order = np.argsort(hashes)
+        if len(np.unique(hashes)) != len(hashes):
+            raise ValueError("Vocabulary hash collision; cannot export")
+        arrays['vocab_hashes'] = hashes[order]
+        arrays['vocab_columns'] = np.array([vectorizer.vocabulary_[term] for term in terms], dtype=np.int32)[order]
+        if vectorizer.use_idf:
+            arrays['idf'] = vectorizer.idf_.astype(np.float32)
+
+    inference_dir = os.path.join(model_dir, INFERENCE_DIR)
+    os.makedirs(inference_dir, exist_ok=True)
+    version = str(int(time.time() * 1000))
+    files = {}
+    for name, array in arrays.items():
+        files[name] = f"{name}-{version}.npy"
+        np.save(os.path.join(inference_dir, files[name]), array)
+    meta = {
+        'kind': kind,
+        'n_features': int(n_features),
+        'intercept': sign * float(np.ravel(classifier.intercept_)[0]),
+        'lowercase': bool(vectorizer.lowercase),
+        'ngram_range': list(vectorizer.ngram_range),
+        'token_pattern': vectorizer.token_pattern,
+        'files': files,
+    }
+    meta_path = os.path.join(inference_dir, INFERENCE_META)
+    with open(meta_path + ".tmp", 'w') as f:
+        json.dump(meta, f, indent=2)
+    os.replace(meta_path + ".tmp", meta_path)
+
+    # Processes that mapped the previous export keep their pages after the unlink
+    for name in os.listdir(inference_dir):
+        if name.endswith(".npy") and name not in files.values():
+            os.remove(os.path.join(inference_dir, name))
+    logging.info(f"Exported {kind} inference artifact to {inference_dir}")
+
+
+def train_tfidf(data_path, model_dir):
+    """Fit TF-IDF and logistic regression on the whole CSV in memory."""
+    df = pd.read_csv(data_path)
+    vectorizer = TfidfVectorizer(max_features=5000)
+    X = vectorizer.fit_transform(_texts(df))
+    clf = LogisticRegression()
+    clf.fit(X, df['label'])
+    _save(model_dir, clf, vectorizer)
+    logging.info(f"Trained TF-IDF model on {len(df)} emails")
+
+
+def train_hashed(data_path, model_dir, chunk_size=CHUNK_SIZE, n_features=HASH_FEATURES, warm_start=False, epochs=1):
+    """
+    Stream the CSV in chunks through a HashingVectorizer into an
+    SGDClassifier with partial_fit, so memory is bounded by the chunk size
+    rather than the corpus. The vectorizer is stateless: the saved
+    vectorizer.pkl holds only hashing parameters, no vocabulary.
+
+    With warm_start the saved hashed model is updated with the new rows
+    (e.g. newly labelled production mail) instead of trained from zero.
+    Each chunk is scored before it is learned from, giving a running
+    (progressive validation) accuracy.
+    """
+    if warm_start:
+        clf = joblib.load(os.path.join(model_dir, "classifier.pkl"))
+        vectorizer = joblib.load(os.path.join(model_dir, "vectorizer.pkl"))
+        if not hasattr(clf, "partial_fit") or not isinstance(vectorizer, HashingVectorizer):
+            raise ValueError(f"{model_dir} does not hold a hashed model; train one without --warm-start first")
+    else:
+        vectorizer = HashingVectorizer(
+            n_features=n_features, ngram_range=(1, 2), alternate_sign=False, norm='l2'
+        )
+        clf = SGDClassifier(loss="log_loss", alpha=1e-5, random_state=42)
+
+    for epoch in range(epochs):
+        seen = correct = 0
+        for chunk in pd.read_csv(data_path, chunksize=chunk_size):
+            chunk = chunk.dropna(subset=['label']).sample(frac=1, random_state=epoch)
+            if chunk.empty:
+                continue
+            X = vectorizer.transform(_texts(chunk))
+            y = chunk['label'].astype(int)
+            if hasattr(clf, "classes_"):
+                correct += int((clf.predict(X) == y).sum())
+                seen += len(y)
+            clf.partial_fit(X, y, classes=CLASSES)
+        if seen:
+            logging.info(f"Epoch {epoch + 1}: progressive accuracy {correct / seen:.4f} over {seen} emails")
+
+    _save(model_dir, clf, vectorizer)
+    logging.info(f"Saved hashed model to {model_dir}")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Train the recruiter email classifier")
+    parser.add_argument('--mode', choices=('tfidf', 'hashed'), default='tfidf',
+                        help="tfidf fits in memory; hashed streams the CSV and supports warm starts")
+    parser.add_argument('--data', default=DATA_PATH, help="labelled CSV (subject, body, from_email, label)")
+    parser.add_argument('--model-dir', default=MODEL_DIR)
+    parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE, help="rows per chunk in hashed mode")
+    parser.add_argument('--n-features', type=int, default=HASH_FEATURES, help="hashed feature space size")
+    parser.add_argument('--epochs', type=int, default=1, help="passes over the CSV in hashed mode")
+    parser.add_argument('--warm-start', action='store_true',
+                        help="update the saved hashed model with the CSV instead of training from zero")
+    parser.add_argument('--export-only', action='store_true',
+                        help="only export the saved pickles as the NumPy inference artifact")
+    return parser.parse_args()
 
-df = pd.read_csv("../data/labeled_emails.csv")
-df['text'] = df['subject'] + " " + df['body'] + " " + df['from_email']
 
-vectorizer = TfidfVectorizer(max_features=5000)
-X = vectorizer.fit_transform(df['text'])
-y = df['label']  
+def main():
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    args = parse_args()
+    if args.export_only:
+        export_inference(
+            args.model_dir,
+            joblib.load(os.path.join(args.model_dir, "classifier.pkl")),
+            joblib.load(os.path.join(args.model_dir, "vectorizer.pkl"))
+        )
+    elif args.mode == 'hashed':
+        train_hashed(args.data, args.model_dir, chunk_size=args.chunk_size, n_features=args.n_features,
+                     warm_start=args.warm_start, epochs=args.epochs)
+    else:
+        train_tfidf(args.data, args.model_dir)
 
-clf = LogisticRegression()
-clf.fit(X, y)
 
-joblib.dump(clf, "../models/classifier.pkl")
-joblib.dump(vectorizer, "../models/vectorizer.pkl")
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,260 @@
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from dotenv import load_dotenv
+
+load_dotenv()
+
+WRITE_QUEUE_SIZE = int(os.getenv('WRITE_QUEUE_SIZE', 1000))
+WRITE_FLUSH_CONTACTS = int(os.getenv('WRITE_FLUSH_CONTACTS', 500))
+WRITE_FLUSH_SECONDS = float(os.getenv('WRITE_FLUSH_SECONDS', 5))
+# How long to keep spooling after a failed flush before trying the DB again
+WRITE_RETRY_SECONDS = float(os.getenv('WRITE_RETRY_SECONDS', 30))
+
+_STOP = object()
+
+
+class WriteBehindStorage:
+    """
+    Background writer in front of StorageManager, so fetch and extraction
+    never wait on the database.
+
+    save_contacts and log_email_activity only enqueue onto a bounded queue
+    (a full queue blocks the caller, which is the backpressure). A single
+    writer thread buffers contacts per account, sums activity counts per
+    account, and flushes when WRITE_FLUSH_CONTACTS contacts are pending or
+    WRITE_FLUSH_SECONDS have passed. When a flush fails the pending writes
+    are appended to a local spool file; the spool is replayed once the
+    database is reachable again, and on the next start.
+
+    save_last_run is queued behind the writes enqueued before it. The
+    writer keeps only the latest checkpoint per account and saves it after
+    the next flush, once those contacts are in the database or the spool.
+    If spooling fails the writes are lost, so no later checkpoint is saved
+    in this run and the next run fetches those messages again. Checkpoint
+    reads wait for queued checkpoints, then go to the wrapped storage.
+
+    A replay first renames the spool aside and records how many of its
+    writes have been applied, so a crash mid-replay repeats at most the
+    write that was in flight on the next start.
+    """
+
+    def __init__(self, storage, spool_path=None, queue_size=WRITE_QUEUE_SIZE,
+                 flush_contacts=WRITE_FLUSH_CONTACTS, flush_seconds=WRITE_FLUSH_SECONDS,
+                 retry_seconds=WRITE_RETRY_SECONDS):
+        self.logger = logging.getLogger(__name__)
+        self.storage = storage
+        self.spool_path = spool_path or os.path.join(storage.data_dir, 'write_spool.jsonl')
+        self.replay_path = self.spool_path + '.replay'
+        self.replay_progress_path = self.replay_path + '.applied'
+        self.flush_contacts = flush_contacts
+        self.flush_seconds = flush_seconds
+        self.retry_seconds = retry_seconds
+        self.queue = queue.Queue(maxsize=queue_size)
+
+        self._contacts = {}
+        self._activity = {}
+        self._checkpoints = {}
+        self._pending_contacts = 0
+        self._retry_at = 0.0
+        self._writes_lost = False
+        self.stats = {'flushes': 0, 'contacts_written': 0, 'spooled': 0, 'replayed': 0}
+
+        self._thread = threading.Thread(target=self._run, name='storage-writer', daemon=True)
+        self._thread.start()
+
+    # StorageManager interface
+
+    def save_contacts(self, email_account, contacts):
+        if contacts:
+            self.queue.put(('contacts', email_account, list(contacts)))
+
+    def log_email_activity(self, candidate_email, emails_count):
+        self.queue.put(('activity', candidate_email, emails_count))
+
+    def load_last_run(self):
+        self.flush()
+        return self.storage.load_last_run()
+
+    def resolve_last_uid(self, email_account, uid_validity=None):
+        self.flush()
+        return self.storage.resolve_last_uid(email_account, uid_validity)
+
+    def save_last_run(self, email_account, last_uid, uid_validity=None):
+        self.queue.put(('checkpoint', email_account, (last_uid, uid_validity)))
+
+    def flush(self, timeout=None):
+        """Block until everything enqueued so far has been written or spooled."""
+        done = threading.Event()
+        self.queue.put(('flush', done, None))
+        return done.wait(timeout)
+
+    def close(self, timeout=None):
+        """Flush, stop the writer thread and close the wrapped storage."""
+        if self._thread.is_alive():
+            self.queue.put((_STOP, None, None))
+            self._thread.join(timeout)
+        self.logger.info(f"Storage writer stopped: {self.stats}")
+        self.storage.close()
+
+    # Writer thread
+
+    def _run(self):
+        self._replay_spool()
+        next_flush = time.monotonic() + self.flush_seconds
+        while True:
+            try:
+                kind, key, value = self.queue.get(timeout=max(0.0, next_flush - time.monotonic()))
+            except queue.Empty:
+                kind = None
+
+            if kind == 'contacts':
+                self._contacts.setdefault(key, []).extend(value)
+                self._pending_contacts += len(value)
+            elif kind == 'activity':
+                self._activity[key] = self._activity.get(key, 0) + value
+            elif kind == 'checkpoint':
+                self._checkpoints[key] = value
+
+            if (kind in ('flush', _STOP) or self._pending_contacts >= self.flush_contacts
+                    or time.monotonic() >= next_flush):
+                self._flush()
+                next_flush = time.monotonic() + self.flush_seconds
+
+            if kind == 'flush':
+                key.set()
+            elif kind is _STOP:
+                return
+
+    def _flush(self):
+        checkpoints, self._checkpoints = self._checkpoints, {}
+        if self._contacts or self._activity:
+            self._write_pending()
+        for account, (last_uid, uid_validity) in checkpoints.items():
+            self._save_checkpoint(account, last_uid, uid_validity)
+
+    def _write_pending(self):
+        records = [
+            {'kind': 'contacts', 'account': account, 'contacts': contacts}
+            for account, contacts in self._contacts.items()
+        ]
+        records.extend(
+            {'kind': 'activity', 'account': account, 'count': count}
+            for account, count in self._activity.items()
+        )
+        self._contacts, self._activity, self._pending_contacts = {}, {}, 0
+
+        if time.monotonic() < self._retry_at:
+            self._spool(records)
+            return
+        if self._spool_pending() and not self._replay_spool():
+            self._spool(records)
+            return
+
+        remaining = self._apply(records)
+        self.stats['flushes'] += 1
+        if remaining:
+            self._spool(remaining)
+
+    def _save_checkpoint(self, email_account, last_uid, uid_validity):
+        if self._writes_lost:
+            self.logger.warning(f"Not saving checkpoint {last_uid} for {email_account}: earlier writes were lost")
+            return
+        try:
+            self.storage.save_last_run(email_account, last_uid, uid_validity)
+        except Exception as e:
+            self.logger.error(f"Failed to save checkpoint for {email_account}: {e}")
+
+    def _apply(self, records):
+        """Write records in order; returns the ones not written after the first failure."""
+        for i, record in enumerate(records):
+            try:
+                if record['kind'] == 'contacts':
+                    inserted, updated = self.storage.upsert_contacts(record['account'], record['contacts'])
+                    self.stats['contacts_written'] += len(record['contacts'])
+                    self.logger.info(
+                        f"Inserted {inserted} new contacts into database ({updated} updated) for {record['account']}"
+                    )
+                else:
+                    self.storage.record_email_activity(record['account'], record['count'])
+            except Exception as e:
+                self.logger.error(f"Database write failed, spooling {len(records) - i} pending writes: {e}")
+                self._retry_at = time.monotonic() + self.retry_seconds
+                return records[i:]
+        return []
+
+    def _spool(self, records):
+        try:
+            with open(self.spool_path, 'a', encoding='utf-8') as f:
+                for record in records:
+                    f.write(json.dumps(record) + '\n')
+                f.flush()
+                os.fsync(f.fileno())
+            self.stats['spooled'] += len(records)
+        except Exception as e:
+            self._writes_lost = True
+            self.logger.error(f"Failed to spool {len(records)} writes, they are lost: {e}")
+
+    def _spool_pending(self):
+        return os.path.exists(self.replay_path) or os.path.exists(self.spool_path)
+
+    def _replay_spool(self):
+        """Apply spooled writes. Returns True when nothing is left to replay."""
+        while self._spool_pending():
+            if not os.path.exists(self.replay_path):
+                try:
+                    # Progress left from a replay that finished but crashed before cleanup
+                    if os.path.exists(self.replay_progress_path):
+                        os.remove(self.replay_progress_path)
+                    os.replace(self.spool_path, self.replay_path)
+                except Exception as e:
+                    self.logger.error(f"Error moving write spool aside: {str(e)}")
+                    return False
+            if not self._replay_file():
+                return False
+        return True
+
+    def _replay_file(self):
+        records = []
+        try:
+            with open(self.replay_path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        records.append(json.loads(line))
+                    except ValueError:
+                        # A torn last line from a crash mid-append
+                        self.logger.warning("Skipping unreadable spool line")
+            applied = 0
+            if os.path.exists(self.replay_progress_path):
+                with open(self.replay_progress_path, 'r', encoding='utf-8') as f:
+                    applied = int(f.read().strip() or 0)
+        except Exception as e:
+            self.logger.error(f"Error reading write spool: {str(e)}")
+            return False
+
+        try:
+            for i in range(applied, len(records)):
+                if self._apply(records[i:i + 1]):
+                    return False
+                self.stats['replayed'] += 1
+                self._save_replay_progress(i + 1)
+            os.remove(self.replay_path)
+            if os.path.exists(self.replay_progress_path):
+                os.remove(self.replay_progress_path)
+        except Exception as e:
+            self.logger.error(f"Error updating write spool: {str(e)}")
+            return False
+        if len(records) > applied:
+            self.logger.info(f"Replayed {len(records) - applied} spooled writes")
+        return True
+
+    def _save_replay_progress(self, applied):
+        tmp_path = self.replay_progress_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(str(applied))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.replay_progress_path)
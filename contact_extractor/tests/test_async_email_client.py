@@ -0,0 +1,241 @@
+import asyncio
+import re
+
+from async_email_client import AsyncEmailClient, AsyncIMAPConnection
+from email_client import UIDWatermark
+
+UID_VALIDITY = 42
+
+
+def make_message(uid):
+    # The body ends a line with something that looks like a literal marker
+    return (
+        f"From: sender{uid}@example.com\r\nSubject: Message {uid}\r\n\r\n"
+        f"Body of {uid} {{3}}\r\n(not a FETCH item)\r\n"
+    ).encode()
+
+
+def parse_uid_set(uid_set, highest):
+    uids = set()
+    for part in uid_set.split(","):
+        lo, _, hi = part.partition(":")
+        lo = int(lo)
+        hi = highest if hi == "*" else int(hi or lo)
+        uids.update(range(min(lo, hi), max(lo, hi) + 1))
+    return uids
+
+
+class FakeIMAPServer:
+    """
+    In-process IMAP stand-in: LOGIN, SELECT, UID SEARCH, UID FETCH (RFC822)
+    and LOGOUT. Every command is answered from its own task, and the first
+    UID FETCH of each connection waits `first_fetch_delay` seconds, so
+    pipelined commands complete out of order. With `piece_delay`, FETCH
+    responses are written one message at a time with that pause between.
+    """
+
+    def __init__(self, messages, first_fetch_delay=0.05, piece_delay=0):
+        self.messages = messages
+        self.first_fetch_delay = first_fetch_delay
+        self.piece_delay = piece_delay
+        self.fetch_commands = []
+        self.server = None
+
+    async def start(self):
+        self.server = await asyncio.start_server(self._session, "127.0.0.1", 0)
+        return self.server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        self.server.close()
+        await self.server.wait_closed()
+
+    async def _session(self, reader, writer):
+        writer.write(b"* OK fake IMAP ready\r\n")
+        fetches = 0
+        tasks = []
+        while True:
+            line = await reader.readline()
+            if not line:
+                break
+            tag, command = line.decode().rstrip("\r\n").split(" ", 1)
+            if command.upper().startswith("UID FETCH"):
+                delay = self.first_fetch_delay if fetches == 0 else 0
+                fetches += 1
+                tasks.append(asyncio.create_task(self._answer(writer, tag, command, delay)))
+            else:
+                await self._answer(writer, tag, command, 0)
+            if command.upper() == "LOGOUT":
+                break
+        await asyncio.gather(*tasks)
+        writer.close()
+
+    async def _answer(self, writer, tag, command, delay):
+        await asyncio.sleep(delay)
+        verb = command.split(" ", 1)[0].upper()
+        highest = max(self.messages)
+        out = []
+        if verb == "SELECT":
+            out.append(f"* {len(self.messages)} EXISTS\r\n".encode())
+            out.append(f"* OK [UIDVALIDITY {UID_VALIDITY}] UIDs valid\r\n".encode())
+        elif verb == "UID" and command.upper().startswith("UID SEARCH"):
+            match = re.search(r"UID (\d+):\*", command)
+            uids = sorted(self.messages)
+            if match:
+                uids = [uid for uid in uids if uid >= int(match.group(1))] or [highest]
+            out.append(("* SEARCH " + " ".join(map(str, uids)) + "\r\n").encode())
+        elif verb == "UID":
+            uid_set = command.split(" ")[2]
+            requested = sorted(parse_uid_set(uid_set, highest) & set(self.messages))
+            self.fetch_commands.append(requested)
+            for uid in requested:
+                body = self.messages[uid]
+                out.append(f"* {uid} FETCH (UID {uid} RFC822 {{{len(body)}}}\r\n".encode() + body + b")\r\n")
+        elif verb == "LOGOUT":
+            out.append(b"* BYE logging out\r\n")
+        out.append(f"{tag} OK {verb} completed\r\n".encode())
+        if self.piece_delay and verb == "UID":
+            for piece in out:
+                writer.write(piece)
+                await writer.drain()
+                await asyncio.sleep(self.piece_delay)
+            return
+        writer.write(b"".join(out))
+        await writer.drain()
+
+
+def run_with_server(messages, scenario, **server_args):
+    async def main():
+        server = FakeIMAPServer(messages, **server_args)
+        port = await server.start()
+        try:
+            return await scenario(server, port)
+        finally:
+            await server.stop()
+    return asyncio.run(main())
+
+
+def account(port):
+    return {"email": "user@example.com", "password": "secret", "imap_server": "127.0.0.1",
+            "imap_port": port, "imap_ssl": False}
+
+
+def test_pipelined_fetches_are_matched_to_their_tags():
+    messages = {uid: make_message(uid) for uid in range(1, 7)}
+
+    async def scenario(server, port):
+        conn = AsyncIMAPConnection("127.0.0.1", port, use_ssl=False, timeout=5)
+        await conn.open()
+        try:
+            await conn.login("user@example.com", "secret")
+            uid_validity = await conn.select("INBOX")
+            # The first command is answered last
+            first, second = await asyncio.gather(
+                conn.uid_fetch([1, 2, 3], "(RFC822)"),
+                conn.uid_fetch([4, 5, 6], "(RFC822)")
+            )
+            return uid_validity, first, second
+        finally:
+            await conn.close()
+
+    uid_validity, first, second = run_with_server(messages, scenario)
+    assert uid_validity == UID_VALIDITY
+    assert sorted(first) == ["1", "2", "3"]
+    assert sorted(second) == ["4", "5", "6"]
+    for records in (first, second):
+        for uid, record in records.items():
+            assert record["RFC822"] == messages[int(uid)]
+
+
+def fetch_once(messages, timeout, **server_args):
+    async def scenario(server, port):
+        conn = AsyncIMAPConnection("127.0.0.1", port, use_ssl=False, timeout=timeout)
+        await conn.open()
+        try:
+            await conn.login("user@example.com", "secret")
+            await conn.select("INBOX")
+            try:
+                return await conn.uid_fetch(sorted(messages), "(RFC822)"), None
+            except Exception as e:
+                later = None
+                try:
+                    await conn.uid_search("ALL")
+                except Exception as e2:
+                    later = e2
+                return e, later
+        finally:
+            await conn.close()
+    return run_with_server(messages, scenario, **server_args)
+
+
+def test_timeout_applies_per_read_not_per_command():
+    messages = {uid: make_message(uid) for uid in range(1, 7)}
+    # The response takes about 0.5s in total but never pauses for 0.2s
+    records, _ = fetch_once(messages, timeout=0.2, first_fetch_delay=0, piece_delay=0.07)
+    assert sorted(records) == ["1", "2", "3", "4", "5", "6"]
+
+
+def test_silent_server_fails_the_pending_and_later_commands():
+    messages = {uid: make_message(uid) for uid in range(1, 3)}
+    error, later = fetch_once(messages, timeout=0.1, first_fetch_delay=0.5)
+    assert isinstance(error, asyncio.TimeoutError)
+    assert isinstance(later, asyncio.TimeoutError)
+
+
+def test_uid_search_skips_the_highest_uid_below_the_range():
+    messages = {uid: make_message(uid) for uid in (3, 8, 9)}
+
+    async def scenario(server, port):
+        client = AsyncEmailClient(account(port), connections=1, timeout=5)
+        assert await client.connect()
+        try:
+            return list((await client.snapshot_uids(since_uid=9)).uids), list((await client.snapshot_uids(3)).uids)
+        finally:
+            await client.disconnect()
+
+    after_last, after_three = run_with_server(messages, scenario)
+    assert after_last == []
+    assert after_three == [8, 9]
+
+
+def test_partition_gives_disjoint_contiguous_ranges():
+    client = AsyncEmailClient(account(0), connections=3)
+    client.connections = [object()] * 3
+
+    uids = list(range(100, 111))
+    parts = client._partition(uids)
+    assert len(parts) == 3
+    assert [uid for part in parts for uid in part] == uids
+    for part in parts:
+        assert part == list(range(part[0], part[-1] + 1))
+
+    assert client._partition([5, 6]) == [[5], [6]]
+    assert client._partition([]) == []
+
+
+def test_iter_batches_covers_every_uid_over_several_connections():
+    messages = {uid: make_message(uid) for uid in range(1, 24)}
+
+    async def scenario(server, port):
+        client = AsyncEmailClient(account(port), connections=3, pipeline_depth=2, batch_size=3, timeout=5)
+        assert await client.connect()
+        try:
+            assert client.uid_validity == UID_VALIDITY
+            cursor = await client.snapshot_uids(since_uid=2)
+            watermark = UIDWatermark(cursor.uids, start_uid=2)
+            batches = []
+            async for emails, batch_uids in client.iter_batches(cursor):
+                batches.append((emails, batch_uids))
+                watermark.mark_done(batch_uids)
+            return cursor, watermark, batches
+        finally:
+            await client.disconnect()
+
+    cursor, watermark, batches = run_with_server(messages, scenario)
+    covered = sorted(uid for _, batch_uids in batches for uid in batch_uids)
+    assert covered == list(range(3, 24)) == list(cursor.uids)
+    assert all(len(batch_uids) <= 3 for _, batch_uids in batches)
+    for emails, batch_uids in batches:
+        assert [int(record["uid"]) for record in emails] == batch_uids
+        for record in emails:
+            assert record["message"]["Subject"] == f"Message {record['uid']}"
+    assert watermark.complete and watermark.value == 23
@@ -0,0 +1,55 @@
+import random
+import re
+
+from body_cleaner import clean_body, trim_quoted_reply
+
+
+def regex_trim(text):
+    # What clean_body used before the string-search version
+    return re.split(r"On .+ wrote:", text)[0]
+
+
+def test_trim_matches_the_regex_it_replaced():
+    cases = [
+        "Thanks,\nJane\n\nOn Mon, Jan 6, 2025 at 9:00 AM Bob <bob@example.com> wrote:\n> hi",
+        "Jane rewrote: the spec\nOn Tue Bob wrote:\n> old",
+        "On Tue someone rewrote: the spec\nmore",
+        "On Tue Bob\nwrote: not a reply header",
+        "On  wrote:",
+        "On x wrote:",
+        "Once upon a time On Tue Bob wrote: x",
+        "on tue bob wrote: lower case is not a reply header",
+        "Page one\x0cOn Tue Bob wrote:\x0c> quoted",
+        "Hello\r\nOn Tue, Bob wrote:\r\n> quoted\r\n",
+        "Hi On Tue Bob wrote: x",
+        "On Mon A wrote: first On Tue B wrote: second",
+        "wrote: On",
+        "",
+        "No quote here at all",
+    ]
+    for text in cases:
+        assert trim_quoted_reply(text) == regex_trim(text), repr(text)
+
+
+def test_trim_matches_the_regex_on_random_text():
+    rng = random.Random(22)
+    pieces = ["On ", " wrote:", "wrote:", "re", "x", " ", "\n", "\r", "\x0c", "On", "O", "n "]
+    for _ in range(2000):
+        text = "".join(rng.choice(pieces) for _ in range(rng.randint(0, 12)))
+        assert trim_quoted_reply(text) == regex_trim(text), repr(text)
+
+
+def test_trim_cuts_at_original_message_line():
+    text = "Regards,\nJane\n-----Original Message-----\nFrom: Bob\n"
+    assert trim_quoted_reply(text) == "Regards,\nJane\n"
+
+
+def test_clean_body_converts_html_and_drops_script():
+    html = "<html><head><style>p {}</style></head><body><p>Hi&nbsp;there</p><script>x()</script>" \
+           "<div>Call 415-555-2671</div></body></html>"
+    assert clean_body(html, is_html=True).split() == ["Hi", "there", "Call", "415-555-2671"]
+
+
+def test_clean_body_keeps_bracketed_addresses_in_plain_text():
+    text = "Reach me at <jane@example.com> &amp; thanks"
+    assert clean_body(text) == "Reach me at <jane@example.com> & thanks"
@@ -0,0 +1,42 @@
+import pytest
+
+pytest.importorskip("phonenumbers")
+
+from entity_scanner import scan_entities
+
+
+def phones(text):
+    return scan_entities(text)["phones"]
+
+
+def test_dates_and_times_are_not_phones():
+    assert phones("Interview scheduled 2025-03-18 14:00 EST") == []
+    assert phones("Ref 2024-01-15 12:30") == []
+
+
+def test_neighbouring_numbers_are_split():
+    assert phones("Tel 4155552671 / 6465550134") == ["+14155552671", "+16465550134"]
+    assert phones("Call 415-555-2671 / 415-555-2672") == ["+14155552671", "+14155552672"]
+
+
+def test_labelled_numbers_rank_first_and_fax_last():
+    assert phones("Office 212-555-0134\nCell: (646) 555-0199") == ["+16465550199", "+12125550134"]
+    # A number keeps its best label wherever it appears
+    text = "Fax: 415-555-2672\nOffice 212-555-0134\nCall 415-555-2672 anytime"
+    assert phones(text) == ["+14155552672", "+12125550134"]
+    assert phones("Fax 415-555-2672\nOffice 212-555-0134") == ["+12125550134", "+14155552672"]
+
+
+def test_digits_inside_urls_and_addresses_are_not_phones():
+    result = scan_entities(
+        "See https://example.com/jobs/4155552671 or mail 4155552672@example.com, "
+        "https://www.linkedin.com/in/jane-doe-123"
+    )
+    assert result["phones"] == []
+    assert result["emails"] == ["4155552672@example.com"]
+    assert result["linkedin_ids"] == ["jane-doe-123"]
+
+
+def test_no_reply_addresses_rank_last():
+    result = scan_entities("From noreply@example.com, reply to jane@example.com")
+    assert result["emails"] == ["jane@example.com", "noreply@example.com"]
@@ -0,0 +1,29 @@
+from simhash import SimHashIndex, simhash
+
+TEMPLATE = (
+    "Hello {name}, we have an exciting contract role for a senior data engineer with our banking "
+    "client in New York. The role is hybrid three days onsite and runs for twelve months with likely "
+    "extension. Please reply with your updated resume, expected hourly rate and availability for a "
+    "quick call this week."
+)
+
+
+def test_get_returns_nearest_entry_accepted_by_match():
+    index = SimHashIndex()
+    index.put(simhash(TEMPLATE.format(name="Jane")), {"sender": "a@vendor.com"})
+    fingerprint = simhash(TEMPLATE.format(name="John"))
+
+    assert index.get(fingerprint, match=lambda payload: payload["sender"] == "a@vendor.com") == {"sender": "a@vendor.com"}
+    assert index.get(fingerprint, match=lambda payload: payload["sender"] == "b@other.com") is None
+    assert index.stats()["hits"] == 1
+    assert index.stats()["misses"] == 1
+
+
+def test_get_skips_closer_entries_rejected_by_match():
+    index = SimHashIndex()
+    fingerprint = simhash(TEMPLATE.format(name="Jane"))
+    index.put(fingerprint, {"sender": "b@other.com"})
+    index.put(fingerprint ^ 0b11, {"sender": "a@vendor.com"})
+
+    assert index.get(fingerprint)["sender"] == "b@other.com"
+    assert index.get(fingerprint, match=lambda payload: payload["sender"] == "a@vendor.com")["sender"] == "a@vendor.com"